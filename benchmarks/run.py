@@ -0,0 +1,204 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Offline benchmarks of the tagging pipeline against a stubbed AWS backend.
+
+    python -m benchmarks.run --rows 1000 --rows 10000 --scenario csv --scenario csv-async --latency 20
+
+Each scenario and inventory size runs in its own process so that peak RSS is measured per run. Nothing is
+sent to AWS: every client is answered by benchmarks.stub.StubBackend.
+"""
+import contextlib
+import csv
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import click
+
+ACCOUNT = '123456789012'
+REGION = 'us-east-1'
+
+# a synthetic resource ID for each service, by position in the inventory
+RESOURCE_IDS = {
+    'ec2': lambda n: 'i-%017x' % n,
+    's3': lambda n: 'benchmark-bucket-%d' % n,
+    'rds': lambda n: 'arn:aws:rds:%s:%s:db:benchmark-%d' % (REGION, ACCOUNT, n),
+    'elasticfilesystem': lambda n: 'arn:aws:elasticfilesystem:%s:%s:file-system/fs-%08x' % (REGION, ACCOUNT, n),
+    'elasticloadbalancing': lambda n: 'arn:aws:elasticloadbalancing:%s:%s:loadbalancer/app/benchmark-%d/%016x'
+                                      % (REGION, ACCOUNT, n, n),
+    'elasticache': lambda n: 'arn:aws:elasticache:%s:%s:cluster:benchmark-%d' % (REGION, ACCOUNT, n),
+    'es': lambda n: 'arn:aws:es:%s:%s:domain/benchmark-%d' % (REGION, ACCOUNT, n),
+    'kinesis': lambda n: 'arn:aws:kinesis:%s:%s:stream/benchmark-%d' % (REGION, ACCOUNT, n),
+    'cloudfront': lambda n: 'arn:aws:cloudfront::%s:distribution/E%013X' % (ACCOUNT, n),
+    'logs': lambda n: 'arn:aws:logs:%s:%s:log-group:/benchmark/%d' % (REGION, ACCOUNT, n),
+    'dynamodb': lambda n: 'arn:aws:dynamodb:%s:%s:table/benchmark-%d' % (REGION, ACCOUNT, n),
+    'lambda': lambda n: 'arn:aws:lambda:%s:%s:function:benchmark-%d' % (REGION, ACCOUNT, n),
+    'acm-pca': lambda n: 'arn:aws:acm-pca:%s:%s:certificate-authority/00000000-0000-0000-0000-%012x'
+                         % (REGION, ACCOUNT, n),
+    'route53': lambda n: 'arn:aws:route53:::hostedzone/Z%012d' % n,
+}
+# how often each service appears in the mixed inventory
+INVENTORY_MIX = ['ec2'] * 8 + ['s3', 'rds', 'rds', 'lambda', 'dynamodb', 'logs', 'elasticloadbalancing', 'kinesis']
+# distinct tag sets in the inventory, so that batching has something to group
+TAG_SETS = 10
+
+PIPELINE_SCENARIOS = ['sequential', 'multiple', 'csv', 'csv-concurrent', 'csv-async']
+SERVICE_SCENARIOS = ['service:%s' % name for name in sorted(RESOURCE_IDS)]
+SCENARIOS = PIPELINE_SCENARIOS + SERVICE_SCENARIOS
+DEFAULT_ROWS = [1000, 10000, 100000]
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def inventory(rows, service=None):
+    """Yields (resource ID, tags) for a synthetic inventory, of one service or of the mix."""
+    for n in range(rows):
+        name = service or INVENTORY_MIX[n % len(INVENTORY_MIX)]
+        yield RESOURCE_IDS[name](n), {'App': 'app-%d' % (n % TAG_SETS), 'Team': 'benchmark'}
+
+
+def write_csv(path, rows):
+    with open(path, 'w', newline='') as output:
+        writer = csv.writer(output)
+        writer.writerow(['Id', 'Region', 'App', 'Team'])
+        for (resource_id, tags) in inventory(rows):
+            writer.writerow([resource_id, REGION, tags['App'], tags['Team']])
+
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / (1024.0 * 1024.0) if sys.platform == 'darwin' else peak / 1024.0
+
+
+def run_scenario(scenario, rows, latency, throttle_rate, concurrency, rate_limits):
+    """Runs one scenario in this process and returns its measurements."""
+    # never pick up real credentials or configuration, even though no request leaves the process
+    os.environ.update({'AWS_ACCESS_KEY_ID': 'AKIABENCHMARK', 'AWS_SECRET_ACCESS_KEY': 'benchmark',
+                       'AWS_REGION': REGION, 'AWS_CONFIG_FILE': os.devnull,
+                       'AWS_SHARED_CREDENTIALS_FILE': os.devnull})
+    os.environ.pop('AWS_PROFILE', None)
+    os.environ.pop('AWS_SESSION_TOKEN', None)
+
+    from benchmarks.stub import StubBackend
+    from tagger import base_tagger, throttle
+    from tagger.aio import AsyncCSVResourceTagger
+    from tagger.tagger import (TAGGER_CLASSES, CSVResourceTagger, MultipleResourceTagger, SingleResourceTagger,
+                               route)
+    from tagger.utils import ResourceRef
+
+    if not rate_limits:
+        unlimited = (1e9, 1e9)
+        throttle.DEFAULT_RATE_LIMIT = unlimited
+        for limits in (throttle.RATE_LIMITS, throttle.OPERATION_RATE_LIMITS):
+            for key in limits:
+                limits[key] = unlimited
+
+    backend = StubBackend(latency=latency, throttle_rate=throttle_rate)
+    base_tagger.add_client_hook(backend.attach)
+
+    workdir = tempfile.mkdtemp(prefix='aws-tagger-benchmark-')
+    filename = os.path.join(workdir, 'inventory.csv')
+    if scenario.startswith('csv'):
+        write_csv(filename, rows)
+
+    started = time.time()
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        if scenario == 'sequential':
+            # one call per resource, as before batching
+            tagger = SingleResourceTagger(False, False, region=REGION)
+            for (resource_id, tags) in inventory(rows):
+                tagger.tag(resource_id, tags)
+        elif scenario == 'multiple':
+            resource_ids = [resource_id for (resource_id, _) in inventory(rows)]
+            MultipleResourceTagger(False, False, region=REGION, propagate=['volumes']).tag(
+                resource_ids, {'App': 'app-0', 'Team': 'benchmark'})
+        elif scenario == 'csv':
+            CSVResourceTagger(False, False, region=REGION, propagate=['volumes']).tag(filename)
+        elif scenario == 'csv-concurrent':
+            CSVResourceTagger(False, False, region=REGION, propagate=['volumes'],
+                              concurrency=concurrency).tag(filename)
+        elif scenario == 'csv-async':
+            AsyncCSVResourceTagger(False, False, region=REGION, propagate=['volumes'],
+                                   concurrency=concurrency).tag(filename)
+        elif scenario.startswith('service:'):
+            name = scenario.split(':', 1)[1]
+            tagger = TAGGER_CLASSES[name](False, False, region=REGION)
+            for (resource_id, tags) in inventory(rows, service=name):
+                _, target = route(ResourceRef.parse(resource_id))
+                tagger.tag(target, tags)
+        else:
+            raise ValueError('Unknown scenario %s' % scenario)
+    elapsed = time.time() - started
+
+    shutil.rmtree(workdir)
+
+    return {
+        'scenario': scenario,
+        'rows': rows,
+        'seconds': elapsed,
+        'rows_per_second': rows / elapsed if elapsed else 0.0,
+        'api_calls': sum(backend.calls.values()),
+        'calls_by_operation': {'%s:%s' % key: count for (key, count) in sorted(backend.calls.items())},
+        'throttled': backend.throttled,
+        'p50_ms': backend.percentile(0.50) * 1000,
+        'p99_ms': backend.percentile(0.99) * 1000,
+        'peak_rss_mb': peak_rss_mb(),
+    }
+
+
+def format_result(result):
+    return "{scenario:<30} {rows:>7} {seconds:>9.2f} {rows_per_second:>10.0f} {api_calls:>9} {throttled:>9} " \
+           "{p50_ms:>8.2f} {p99_ms:>8.2f} {peak_rss_mb:>9.1f}".format(**result)
+
+
+@click.command()
+@click.option('--scenario', 'scenarios', multiple=True, type=click.Choice(SCENARIOS),
+              help='Scenario to run, repeatable. Defaults to all of them.')
+@click.option('--rows', 'row_counts', multiple=True, type=click.IntRange(1),
+              help='Inventory size, repeatable. Defaults to 1000, 10000 and 100000.')
+@click.option('--latency', default=0.0, type=click.FloatRange(0), help='Milliseconds the stub takes per call.')
+@click.option('--throttle-rate', default=0.0, type=click.FloatRange(0, 1),
+              help='Share of calls the stub throttles.')
+@click.option('--concurrency', default=8, type=click.IntRange(1), show_default=True,
+              help='Concurrency of the csv-concurrent and csv-async scenarios.')
+@click.option('--rate-limits/--no-rate-limits', default=False,
+              help='Apply the client-side rate limits. Off by default so runs measure the tool itself.')
+@click.option('--json', 'as_json', is_flag=True, default=False, help='Print one JSON object per run.')
+@click.option('--child', is_flag=True, default=False, hidden=True)
+def cli(scenarios, row_counts, latency, throttle_rate, concurrency, rate_limits, as_json, child):
+    scenarios = scenarios or SCENARIOS
+    row_counts = row_counts or DEFAULT_ROWS
+
+    if child:
+        result = run_scenario(scenarios[0], row_counts[0], latency / 1000.0, throttle_rate, concurrency,
+                              rate_limits)
+        print(json.dumps(result))
+        return
+
+    if not as_json:
+        print("{0:<30} {1:>7} {2:>9} {3:>10} {4:>9} {5:>9} {6:>8} {7:>8} {8:>9}".format(
+            'scenario', 'rows', 'seconds', 'rows/s', 'calls', 'throttled', 'p50 ms', 'p99 ms', 'RSS MB'))
+
+    for rows in row_counts:
+        for scenario in scenarios:
+            command = [sys.executable, '-m', 'benchmarks.run', '--child', '--scenario', scenario,
+                       '--rows', str(rows), '--latency', str(latency), '--throttle-rate', str(throttle_rate),
+                       '--concurrency', str(concurrency),
+                       '--rate-limits' if rate_limits else '--no-rate-limits']
+            output = subprocess.check_output(command, cwd=ROOT)
+            result = json.loads(output.decode('utf-8').strip().splitlines()[-1])
+            if as_json:
+                print(json.dumps(result))
+            else:
+                print(format_result(result))
+            sys.stdout.flush()
+
+
+if __name__ == '__main__':
+    cli()
@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Startup time of the aws-tagger command, for the runs where it dominates: --help and tagging a single
+resource, as provisioning hooks do.
+
+    python -m benchmarks.startup --runs 20
+
+Each run is a fresh interpreter, timed from the outside. The single-resource run is answered by
+benchmarks.stub.StubBackend, so nothing is sent to AWS. Each scenario also reports how many tagger modules
+it imported and whether it imported boto3.
+"""
+import json
+import os
+import subprocess
+import sys
+import time
+
+import click
+
+from benchmarks.run import ACCOUNT, REGION, ROOT
+
+SCENARIOS = {
+    'help': ['--help'],
+    'single-ec2': ['--resource', 'i-0123456789abcdef0', '--tag', 'App:benchmark', '--no-tag-volumes'],
+    'single-rds': ['--resource', 'arn:aws:rds:%s:%s:db:benchmark' % (REGION, ACCOUNT), '--tag', 'App:benchmark'],
+}
+
+# never pick up real credentials or configuration, even though no request leaves the process
+ENVIRONMENT = {'AWS_ACCESS_KEY_ID': 'AKIABENCHMARK', 'AWS_SECRET_ACCESS_KEY': 'benchmark', 'AWS_REGION': REGION,
+               'AWS_CONFIG_FILE': os.devnull, 'AWS_SHARED_CREDENTIALS_FILE': os.devnull}
+
+
+def run_child(scenario):
+    """Runs the CLI in this process and prints what it imported. The stub is attached through a client
+    hook, which is only called once a client is created, so it does not change what is imported."""
+    from tagger import base_tagger
+    from tagger.cli import cli
+
+    def attach_stub(aws_client):
+        from benchmarks.stub import StubBackend
+        StubBackend().attach(aws_client)
+
+    base_tagger.add_client_hook(attach_stub)
+    try:
+        cli(SCENARIOS[scenario], standalone_mode=False)
+    except SystemExit:
+        pass
+
+    loaded = sorted(name for name in sys.modules if name.startswith('tagger.') and name.endswith('_tagger')
+                    and name != 'tagger.base_tagger')
+    print(json.dumps({'tagger_modules': loaded, 'boto3': 'boto3' in sys.modules}))
+
+
+def measure(scenario, runs):
+    environment = dict(os.environ, **ENVIRONMENT)
+    environment.pop('AWS_PROFILE', None)
+    environment.pop('AWS_SESSION_TOKEN', None)
+    command = [sys.executable, '-m', 'benchmarks.startup', '--child', '--scenario', scenario]
+
+    timings = []
+    output = None
+    for _ in range(runs):
+        started = time.time()
+        output = subprocess.check_output(command, cwd=ROOT, env=environment)
+        timings.append(time.time() - started)
+
+    imported = json.loads(output.decode('utf-8').strip().splitlines()[-1])
+    timings.sort()
+    return {
+        'scenario': scenario,
+        'runs': runs,
+        'median_ms': timings[len(timings) // 2] * 1000,
+        'min_ms': timings[0] * 1000,
+        'max_ms': timings[-1] * 1000,
+        'tagger_modules': len(imported['tagger_modules']),
+        'boto3': imported['boto3'],
+    }
+
+
+@click.command()
+@click.option('--scenario', 'scenarios', multiple=True, type=click.Choice(sorted(SCENARIOS)),
+              help='Scenario to run, repeatable. Defaults to all of them.')
+@click.option('--runs', default=10, type=click.IntRange(1), show_default=True, help='Runs of each scenario.')
+@click.option('--json', 'as_json', is_flag=True, default=False, help='Print one JSON object per scenario.')
+@click.option('--child', is_flag=True, default=False, hidden=True)
+def cli(scenarios, runs, as_json, child):
+    scenarios = scenarios or sorted(SCENARIOS)
+
+    if child:
+        run_child(scenarios[0])
+        return
+
+    if not as_json:
+        print("{0:<14} {1:>5} {2:>10} {3:>8} {4:>8} {5:>8} {6:>6}".format(
+            'scenario', 'runs', 'median ms', 'min ms', 'max ms', 'taggers', 'boto3'))
+
+    for scenario in scenarios:
+        result = measure(scenario, runs)
+        if as_json:
+            print(json.dumps(result))
+        else:
+            print("{scenario:<14} {runs:>5} {median_ms:>10.1f} {min_ms:>8.1f} {max_ms:>8.1f} {tagger_modules:>8} "
+                  "{boto3!s:>6}".format(**result))
+        sys.stdout.flush()
+
+
+if __name__ == '__main__':
+    cli()
@@ -0,0 +1,103 @@
+import collections
+import random
+import threading
+import time
+
+from botocore.awsrequest import AWSResponse
+
+# an empty success response for each protocol, formatted with the operation name
+SUCCESS_BODIES = {
+    'ec2': '<{0}Response/>',
+    'query': '<{0}Response><{0}Result/></{0}Response>',
+    'json': '{{}}',
+    'rest-json': '{{}}',
+    'rest-xml': '',
+}
+# operations whose callers read a list or structure out of the response
+OPERATION_BODIES = {
+    ('ec2', 'DescribeInstances'): b'<DescribeInstancesResponse><reservationSet/></DescribeInstancesResponse>',
+    ('ec2', 'DescribeTags'): b'<DescribeTagsResponse><tagSet/></DescribeTagsResponse>',
+    ('s3', 'GetBucketLocation'): b'<LocationConstraint xmlns="http://s3.amazonaws.com/doc/2006-03-01/"/>',
+    ('sts', 'AssumeRole'): b'<AssumeRoleResponse><AssumeRoleResult><Credentials>'
+                           b'<AccessKeyId>AKIABENCHMARK</AccessKeyId><SecretAccessKey>benchmark</SecretAccessKey>'
+                           b'<SessionToken>benchmark</SessionToken><Expiration>2100-01-01T00:00:00Z</Expiration>'
+                           b'</Credentials></AssumeRoleResult></AssumeRoleResponse>',
+}
+# (status, body) of a throttling error for each protocol
+THROTTLE_RESPONSES = {
+    'ec2': (503, b'<Response><Errors><Error><Code>RequestLimitExceeded</Code><Message>Request limit exceeded.'
+                 b'</Message></Error></Errors></Response>'),
+    'query': (400, b'<ErrorResponse><Error><Code>Throttling</Code><Message>Rate exceeded</Message></Error>'
+                   b'</ErrorResponse>'),
+    'json': (400, b'{"__type": "ThrottlingException", "message": "Rate exceeded"}'),
+    'rest-json': (429, b'{"__type": "ThrottlingException", "message": "Rate exceeded"}'),
+    'rest-xml': (503, b'<Error><Code>SlowDown</Code><Message>Please reduce your request rate.</Message></Error>'),
+}
+
+
+class _Body(object):
+    def __init__(self, content):
+        self.content = content
+
+    def stream(self, **kwargs):
+        yield self.content
+
+
+class StubBackend(object):
+    """Answers every request made through a botocore client locally, after `latency` seconds, and throttles
+    a `throttle_rate` share of them. Requests are still serialized, signed and their responses parsed, so
+    the benchmarks measure the whole client path except the network. Counts calls by operation and records
+    the latency of each call, from any wait for its rate limiter to its parsed response."""
+
+    def __init__(self, latency=0.0, throttle_rate=0.0, seed=0):
+        self.latency = latency
+        self.throttle_rate = throttle_rate
+        self.random = random.Random(seed)
+        self.calls = collections.Counter()
+        self.throttled = 0
+        self.latencies = []
+        self.lock = threading.Lock()
+
+    def attach(self, aws_client):
+        service = aws_client.meta.service_model.service_name
+        protocol = aws_client.meta.service_model.protocol
+
+        def send(request, event_name, **kwargs):
+            operation = event_name.rsplit('.', 1)[-1]
+            with self.lock:
+                self.calls[(service, operation)] += 1
+                throttle = self.throttle_rate and self.random.random() < self.throttle_rate
+                if throttle:
+                    self.throttled += 1
+
+            if self.latency:
+                time.sleep(self.latency)
+            if throttle:
+                status, body = THROTTLE_RESPONSES[protocol]
+            else:
+                body = OPERATION_BODIES.get((service, operation))
+                if body is None:
+                    body = SUCCESS_BODIES[protocol].format(operation).encode('utf-8')
+                status = 200
+            return AWSResponse(request.url, status, {}, _Body(body))
+
+        def started(context, **kwargs):
+            context['benchmark_started'] = time.time()
+
+        def finished(context, **kwargs):
+            started_at = context.get('benchmark_started')
+            if started_at is not None:
+                with self.lock:
+                    self.latencies.append(time.time() - started_at)
+
+        aws_client.meta.events.register('before-send', send)
+        aws_client.meta.events.register_first('before-call', started)
+        aws_client.meta.events.register('after-call', finished)
+        aws_client.meta.events.register('after-call-error', finished)
+
+    def percentile(self, fraction):
+        with self.lock:
+            latencies = sorted(self.latencies)
+        if not latencies:
+            return 0.0
+        return latencies[min(len(latencies) - 1, int(fraction * len(latencies)))]
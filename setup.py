@@ -14,7 +14,6 @@ setup(
         'docutils>=0.13.1',
         'futures>=3.0.5',
         'jmespath>=0.9.1',
-        'retrying>=1.3.3',
         's3transfer>=0.1.10',
         'six>=1.10.0'
     ],
@@ -1,7 +1,8 @@
 import botocore
 
-from tagger.base_tagger import is_retryable_exception, format_dict, dict_to_aws_tags, client
-from retrying import retry
+from tagger.base_tagger import adaptive_retry, format_dict, dict_to_aws_tags, client
+
+NOT_FOUND_ERRORS = ['ValidationException']
 
 class ACMPCATagger(object):
     def __init__(self, dryrun, verbose, role=None, region=None):
@@ -17,11 +18,28 @@ class ACMPCATagger(object):
             try:
                 self._aws_pca_add_tags(CertificateAuthorityArn=resource_arn, Tags=aws_tags)
             except botocore.exceptions.ClientError as exception:
-                if exception.response["Error"]["Code"] in ['ValidationException']:
+                if exception.response["Error"]["Code"] in NOT_FOUND_ERRORS:
+                    print("Resource not found: %s" % resource_arn)
+                else:
+                    raise exception
+
+    def untag(self, resource_arn, keys):
+        if self.verbose:
+            print("untagging %s: %s" % (resource_arn, ", ".join(keys)))
+        if not self.dryrun:
+            try:
+                self._aws_pca_remove_tags(CertificateAuthorityArn=resource_arn,
+                                          Tags=[{'Key': key} for key in keys])
+            except botocore.exceptions.ClientError as exception:
+                if exception.response["Error"]["Code"] in NOT_FOUND_ERRORS:
                     print("Resource not found: %s" % resource_arn)
                 else:
                     raise exception
 
-    @retry(retry_on_exception=is_retryable_exception, stop_max_delay=30000, wait_exponential_multiplier=1000)
+    @adaptive_retry
     def _aws_pca_add_tags(self, **kwargs):
-        return self.acm_pca.tag_certificate_authority(**kwargs)
\ No newline at end of file
+        return self.acm_pca.tag_certificate_authority(**kwargs)
+
+    @adaptive_retry
+    def _aws_pca_remove_tags(self, **kwargs):
+        return self.acm_pca.untag_certificate_authority(**kwargs)
@@ -0,0 +1,91 @@
+import asyncio
+import collections
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+from .coalesce import COALESCE_WINDOW
+from .concurrency import ThreadLocalOutput, capture_output
+from .tagger import CSVResourceTagger
+
+# upper bound on tag operations in flight across all services and regions
+MAX_IN_FLIGHT = 256
+
+
+class AsyncCSVResourceTagger(CSVResourceTagger):
+    """Drives a CSV file through asyncio instead of a ConcurrentRunner. Each (service, region) lane may have
+    `concurrency` requests in flight and the whole run at most `max_in_flight`. Output is printed in file
+    order, as with the synchronous tagger.
+
+    botocore's clients block, so each request still runs on a thread of its lane's executor; the event loop
+    only schedules them. The service taggers therefore have no async tag() of their own, which would be no
+    more than the same call handed to an executor."""
+
+    def __init__(self, dryrun, verbose, role=None, region=None, concurrency=1, only_changed=False, tag_cache=None,
+                 checkpoint=None, role_map=None, propagate=None, input_format=None, coalesce_window=COALESCE_WINDOW,
+                 remove_tags=None, replace=False, max_in_flight=MAX_IN_FLIGHT):
+        super(AsyncCSVResourceTagger, self).__init__(dryrun, verbose, role=role, region=region,
+                                                     concurrency=concurrency, only_changed=only_changed,
+                                                     tag_cache=tag_cache, checkpoint=checkpoint, role_map=role_map,
+                                                     propagate=propagate, input_format=input_format,
+                                                     coalesce_window=coalesce_window, remove_tags=remove_tags,
+                                                     replace=replace)
+        self.max_in_flight = max(max_in_flight, concurrency)
+
+    def tag(self, filename):
+        asyncio.run(self.tag_async(filename))
+
+    async def tag_async(self, filename):
+        output = ThreadLocalOutput(sys.stdout)
+        # a thread of its own reads, merges and diffs the rows, so none of that blocks the event loop
+        reader = ThreadPoolExecutor(max_workers=1)
+        lanes = {}
+        sys.stdout = output
+        try:
+            await self._run(filename, output, reader, lanes)
+        finally:
+            sys.stdout = output.stream
+            for executor in [reader] + list(lanes.values()):
+                executor.shutdown(wait=True)
+
+        self._report()
+
+    async def _run(self, filename, output, reader, lanes):
+        loop = asyncio.get_running_loop()
+        in_flight = asyncio.Semaphore(self.max_in_flight)
+        pending = collections.deque()
+
+        async def run(lane, fn, *args):
+            # each lane's executor has `concurrency` threads, which is as many of its requests as may be in flight
+            executor = lanes.get(lane)
+            if executor is None:
+                executor = ThreadPoolExecutor(max_workers=self.concurrency)
+                lanes[lane] = executor
+            try:
+                return await loop.run_in_executor(executor, capture_output, output, fn, *args)
+            finally:
+                in_flight.release()
+
+        windows = self._windows(self._prepare(self._rows(filename)))
+        while True:
+            window = await loop.run_in_executor(reader, next, windows, None)
+            if window is None:
+                return
+
+            for row in window:
+                tagger = self._lookup_tagger(row.ref, row.region)
+                # wait for a slot, so that no more than max_in_flight rows are ever queued
+                await in_flight.acquire()
+                pending.append(asyncio.ensure_future(run(tagger.lane(row.ref), self._apply_tags, tagger, row)))
+                while pending and pending[0].done():
+                    output.stream.write(pending.popleft().result())
+
+            while pending:
+                output.stream.write(await pending.popleft())
+
+            flushes = []
+            for (key, tagger) in self.regional_tagger.items():
+                await in_flight.acquire()
+                flushes.append(asyncio.ensure_future(run(('flush', key), self._flush, tagger)))
+            for text in await asyncio.gather(*flushes):
+                output.stream.write(text)
+            self._end_window()
@@ -1,24 +1,109 @@
+import functools
 import os
+import random
 import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
-import boto3
-import botocore
+# boto3 and the rest of botocore take longer to import than everything else together, so they are only
+# imported once a session is needed
+import botocore.exceptions
+
+from tagger import metrics
+from tagger.throttle import attach_rate_limiter, last_limiter
+from tagger.utils import ResourceRef, TagSet, intern_tags
+
+THROTTLING_ERRORS = ['LimitExceededException', 'PriorRequestNotComplete', 'RequestLimitExceeded',
+                     'RequestThrottled', 'RequestThrottledException', 'SlowDown', 'Throttling',
+                     'ThrottlingException', 'TooManyRequestsException']
+
+TRANSIENT_ERRORS = (botocore.exceptions.ConnectionClosedError, botocore.exceptions.ConnectTimeoutError,
+                    botocore.exceptions.EndpointConnectionError, botocore.exceptions.ReadTimeoutError)
+
+# the retry controller does all retrying, so botocore's own retries are turned off
+CLIENT_CONFIG = {'retries': {'total_max_attempts': 1, 'mode': 'standard'}}
+
+
+def is_throttling_exception(exception):
+    return isinstance(exception, botocore.exceptions.ClientError) and \
+        exception.response["Error"]["Code"] in THROTTLING_ERRORS
 
 
 def is_retryable_exception(exception):
-    return not isinstance(exception, botocore.exceptions.ClientError) or \
-        (exception.response["Error"]["Code"] in ['LimitExceededException', 'RequestLimitExceeded', 'Throttling'])
+    return is_throttling_exception(exception) or isinstance(exception, TRANSIENT_ERRORS)
+
+
+class RetryController(object):
+    """Retries throttled and transient failures with full-jitter exponential backoff. A throttle also cuts
+    the send rate of the token bucket the call went through, and each success raises it again, so every
+    worker sharing that service and region backs off together instead of retrying in lockstep."""
+
+    def __init__(self, base_delay=0.5, max_delay=20.0, max_elapsed=30.0, max_attempts=10):
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_elapsed = max_elapsed
+        self.max_attempts = max_attempts
+
+    def call(self, fn, *args, **kwargs):
+        if not metrics.enabled():
+            return self._call(None, fn, *args, **kwargs)
+
+        call = metrics.start_call()
+        try:
+            response = self._call(call, fn, *args, **kwargs)
+        except Exception as exception:
+            metrics.end_call(call, exception)
+            raise
+        metrics.end_call(call)
+        return response
+
+    def _call(self, call, fn, *args, **kwargs):
+        started = time.time()
+        attempt = 0
+        while True:
+            try:
+                response = fn(*args, **kwargs)
+            except Exception as exception:
+                if not is_retryable_exception(exception):
+                    raise
+                if is_throttling_exception(exception):
+                    if call is not None:
+                        call.throttles += 1
+                    limiter = last_limiter()
+                    if limiter is not None:
+                        limiter.throttled()
+
+                attempt += 1
+                delay = self.backoff(attempt)
+                if attempt >= self.max_attempts or time.time() - started + delay > self.max_elapsed:
+                    raise
+                time.sleep(delay)
+                continue
+
+            limiter = last_limiter()
+            if limiter is not None:
+                limiter.succeeded()
+            return response
+
+    def backoff(self, attempt):
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+
+retry_controller = RetryController()
+
+
+def adaptive_retry(method):
+    """Runs a tagger's AWS call through the shared RetryController."""
+    @functools.wraps(method)
+    def wrapper(*args, **kwargs):
+        return retry_controller.call(method, *args, **kwargs)
+    return wrapper
 
 
 def _arn_to_name(resource_arn):
     # Example: arn:aws:elasticloadbalancing:us-east-1:397853141546:loadbalancer/pb-adn-arc2
-    parts = resource_arn.split(':')
-    name = parts[-1]
-    parts = name.split('/', 1)
-    if len(parts) == 2:
-        name = parts[-1]
-
-    return name
+    return ResourceRef.parse(resource_arn).id
 
 
 def format_dict(tags):
@@ -30,35 +115,135 @@ def format_dict(tags):
 
 
 def dict_to_aws_tags(tags):
+    if isinstance(tags, TagSet):
+        return tags.aws_tags
     return [{'Key': key, 'Value': value} for (key, value) in tags.items() if not key.startswith('aws:')]
 
 
+def split_removals(tags):
+    # a tag whose value is None is removed from the resource rather than written
+    return intern_tags(tags).split()
+
+
+def tag_set_key(tags):
+    # hashable key used to group resources that receive an identical set of tags; rows read from a file
+    # already share one TagSet per set of tags, so this is an identity lookup
+    return intern_tags(tags)
+
+
 def aws_tags_to_dict(aws_tags):
     return {x['Key']: x['Value'] for x in aws_tags if not x['Key'].startswith('aws:')}
 
 
-def _fetch_temporary_credentials(role):
-    sts = boto3.client('sts', region_name=os.environ.get('AWS_REGION', 'us-east-1'))
+# roles assumed at once when several accounts are tagged in one run
+MAX_ASSUME_ROLE_WORKERS = 16
 
-    response = sts.assume_role(RoleArn=role, RoleSessionName='aws-tagger.%s' % socket.gethostname())
-    access_key_id = response.get('Credentials', {}).get('AccessKeyId', None)
-    secret_access_key = response.get('Credentials', {}).get('SecretAccessKey', None)
-    session_token = response.get('Credentials', {}).get('SessionToken', None)
-    return access_key_id, secret_access_key, session_token
 
+def _assume_role(role):
+    sts = client('sts', None, os.environ.get('AWS_REGION', 'us-east-1'))
+
+    response = retry_controller.call(sts.assume_role, RoleArn=role,
+                                     RoleSessionName='aws-tagger.%s' % socket.gethostname())
+    return response.get('Credentials', {})
 
-def client(name, role, region):
-    kwargs = {}
 
-    if region:
-        kwargs['region_name'] = region
-    elif os.environ.get('AWS_REGION'):
-        kwargs['region_name'] = os.environ['AWS_REGION']
+def _credential_metadata(role):
+    credentials = _assume_role(role)
+    return {
+        'access_key': credentials.get('AccessKeyId'),
+        'secret_key': credentials.get('SecretAccessKey'),
+        'token': credentials.get('SessionToken'),
+        'expiry_time': credentials['Expiration'].isoformat(),
+    }
 
-    if role:
-        access_key_id, secret_access_key, session_token = _fetch_temporary_credentials(role)
-        kwargs['aws_access_key_id'] = access_key_id
-        kwargs['aws_secret_access_key'] = secret_access_key
-        kwargs['aws_session_token'] = session_token
 
-    return boto3.client(name, **kwargs)
\ No newline at end of file
+_sessions = {}
+_session_locks = {}
+_clients = {}
+_client_hooks = []
+_lock = threading.RLock()
+
+
+def _session(role=None):
+    # one session per role, shared by every client. Assumed-role credentials are fetched the first time
+    # the role is used and botocore refreshes them shortly before they expire. Each role has its own lock
+    # so that one slow AssumeRole does not hold up the others.
+    session = _sessions.get(role)
+    if session is not None:
+        return session
+
+    with _lock:
+        role_lock = _session_locks.setdefault(role, threading.Lock())
+
+    with role_lock:
+        session = _sessions.get(role)
+        if session is None:
+            import boto3
+            if role:
+                import botocore.session
+                from botocore.credentials import RefreshableCredentials
+                botocore_session = botocore.session.get_session()
+                botocore_session._credentials = RefreshableCredentials.create_from_metadata(
+                    metadata=_credential_metadata(role),
+                    refresh_using=lambda: _credential_metadata(role),
+                    method='sts-assume-role')
+                session = boto3.Session(botocore_session=botocore_session)
+            else:
+                session = boto3.Session()
+            with _lock:
+                _sessions[role] = session
+
+    return session
+
+
+def assume_roles(roles, max_workers=MAX_ASSUME_ROLE_WORKERS):
+    """Assumes the roles in parallel ahead of their first use, so that starting a run across many accounts
+    takes as long as the slowest AssumeRole rather than all of them in turn. Returns the roles that could
+    not be assumed, each with its error."""
+    roles = set(role for role in roles if role)
+    failed = {}
+    if not roles:
+        return failed
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(roles))) as executor:
+        futures = {executor.submit(_session, role): role for role in roles}
+        for future in as_completed(futures):
+            try:
+                future.result()
+            except (botocore.exceptions.BotoCoreError, botocore.exceptions.ClientError) as exception:
+                failed[futures[future]] = exception
+
+    return failed
+
+
+def client(name, role, region):
+    if not region:
+        region = os.environ.get('AWS_REGION')
+
+    key = (name, role, region)
+    aws_client = _clients.get(key)
+    if aws_client is None:
+        # assume the role, if need be, before taking the lock shared by every role
+        session = _session(role)
+        with _lock:
+            aws_client = _clients.get(key)
+            if aws_client is None:
+                kwargs = {}
+                if region:
+                    kwargs['region_name'] = region
+                import botocore.config
+                config = botocore.config.Config(**CLIENT_CONFIG)
+                aws_client = attach_rate_limiter(session.client(name, config=config, **kwargs), role=role)
+                if metrics.enabled():
+                    metrics.instrument(aws_client)
+                for hook in _client_hooks:
+                    hook(aws_client)
+                _clients[key] = aws_client
+
+    return aws_client
+
+
+def add_client_hook(hook):
+    """Calls hook(aws_client) on every client created from now on, e.g. to register botocore event handlers."""
+    with _lock:
+        _client_hooks.append(hook)
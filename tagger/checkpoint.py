@@ -0,0 +1,36 @@
+import os
+import threading
+
+# rows tagged, including flushing any batched tags, between checkpoints
+CHECKPOINT_INTERVAL = 1000
+
+
+class Checkpoint(object):
+    """Append-only journal of the numbers of the input rows that have been tagged, one per line. A resumed
+    run loads it and skips those rows before their tags are even parsed."""
+
+    def __init__(self, path, resume=False):
+        self.path = path
+        self.completed = set()
+        self.lock = threading.Lock()
+        if resume and os.path.exists(path):
+            with open(path) as journal:
+                for line in journal:
+                    line = line.strip()
+                    # a run that died mid-write can leave a partial last line
+                    if line.isdigit():
+                        self.completed.add(int(line))
+        self.journal = open(path, 'a' if resume else 'w')
+
+    def done(self, row_number):
+        with self.lock:
+            self.journal.write('%d\n' % row_number)
+
+    def sync(self):
+        with self.lock:
+            self.journal.flush()
+            os.fsync(self.journal.fileno())
+
+    def close(self):
+        with self.lock:
+            self.journal.close()
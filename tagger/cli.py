@@ -1,29 +1,277 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 import click
+import json
+import signal
 import sys
-from .tagger import MultipleResourceTagger, CSVResourceTagger
+from .tagger import MultipleResourceTagger, CSVResourceTagger, SelectResourceTagger
+from .readers import INPUT_FORMATS
+from .propagation import PROPAGATIONS
+from .coalesce import COALESCE_WINDOW
+from .selection import Selection
+from .tag_cache import DEFAULT_TTL, TagCache
+from .checkpoint import Checkpoint
+from . import metrics
 from pprint import pprint
 
-@click.command()
+@click.group(invoke_without_command=True)
 @click.option('--dryrun/--no-dryrun', default=False, help='Verbose output.')
 @click.option('--verbose/--no-verbose', default=False, help='Verbose output.')
 @click.option('--region', help='AWS region.')
 @click.option('--role', help='IAM role to use.')
+@click.option('--role-map', 'role_map_file',
+              help='JSON file mapping account IDs to the IAM role to use for ARNs in that account.')
 @click.option('--resource', multiple=True, help='Resource ID to tag.')
 @click.option('--tag', multiple=True, help='Tag to apply to resource in format "Key:Value".')
-@click.option('--csv', help='CSV file to read data from.')
-def cli(dryrun, verbose, region, role, resource, tag, csv):
+@click.option('--remove-tag', multiple=True,
+              help='Key of a tag to remove from every resource, unless the resource\'s own tags set it. Current tags '
+                   'are read first, so resources without the key cost no removal call. Repeatable.')
+@click.option('--replace', is_flag=True, default=False,
+              help='Leave each resource with exactly the given tags, removing any others. Reads current tags first.')
+@click.option('--select', multiple=True,
+              help='Tag every resource matching all of these terms instead of a list of resources: '
+                   '"tag:Key=Value[,Value]", "tag:Key", "type=ec2:instance[,rds:db]" or "name=pattern". Repeatable.')
+@click.option('--tag-volumes/--no-tag-volumes', default=True, help='Tag the EBS volumes attached to instances.',
+              show_default=True)
+@click.option('--propagate', multiple=True, type=click.Choice(PROPAGATIONS),
+              help='Also tag this kind of dependent resource with the tags of the resource it belongs to. '
+                   'Repeatable.')
+@click.option('--csv', help='CSV file to read data from, or - to read from stdin.')
+@click.option('--input-format', type=click.Choice(INPUT_FORMATS),
+              help='Format of the --csv input. Defaults to jsonl for .jsonl/.ndjson files and csv otherwise.')
+@click.option('--concurrency', default=1, type=click.IntRange(1),
+              help='Concurrent requests per AWS service and region.')
+@click.option('--async', 'use_async', is_flag=True, default=False, help='Tag --csv input with the asyncio engine.')
+@click.option('--parallel-regions', is_flag=True, default=False,
+              help='Tag the resources of each region on a worker of its own, so a slow or failing region does not '
+                   'hold up the others. Output is printed region by region at the end.')
+@click.option('--coalesce-window', type=click.IntRange(0),
+              help='Merge the rows for the same resource that are within this many resources of each other into '
+                   'one write. 0 writes every row. Defaults to %d for --csv and 0 for --resource.' % COALESCE_WINDOW)
+@click.option('--only-changed', is_flag=True, default=False,
+              help='Read current tags first and only write resources whose tags differ.')
+@click.option('--cache', 'cache_file', help='SQLite file caching the last known tags of each resource between runs.')
+@click.option('--cache-ttl', default=DEFAULT_TTL, type=click.IntRange(0),
+              help='Seconds before a cached tag set is read again.', show_default=True)
+@click.option('--checkpoint', 'checkpoint_file',
+              help='Journal of the --csv rows already tagged. Defaults to the input file name plus .checkpoint '
+                   'when --resume is used.')
+@click.option('--resume', is_flag=True, default=False, help='Skip the --csv rows recorded in the checkpoint journal.')
+@click.option('--metrics-log', help='File to append a JSON line to for every AWS API call.')
+@click.option('--metrics-summary', is_flag=True, default=False,
+              help='Print a table of AWS API calls, retries, throttles and latency at the end of the run.')
+@click.option('--metrics-textfile', help='Prometheus textfile to write API call metrics to at the end of the run.')
+@click.option('--statsd', help='StatsD host:port to send API call metrics to.')
+@click.option('--plan', 'plan_file',
+              help='Write a JSON plan of the calls tagging would take, and an estimate of how long, to this file, '
+                   'or - for stdout, instead of tagging. Creates no AWS clients.')
+@click.option('--execute-plan', 'execute_plan_file',
+              help='Tag exactly what a plan written by --plan lists, with the options it was made with.')
+@click.pass_context
+def cli(ctx, dryrun, verbose, region, role, role_map_file, resource, tag, remove_tag, replace, select, tag_volumes,
+        propagate, csv, input_format, concurrency, use_async, parallel_regions, coalesce_window, only_changed,
+        cache_file, cache_ttl, checkpoint_file, resume, metrics_log, metrics_summary, metrics_textfile, statsd,
+        plan_file, execute_plan_file):
+    if ctx.invoked_subcommand is not None:
+        # the subcommand reads the options it shares with a one-off run from ctx.parent.params
+        if csv or select or len(resource) > 0 or len(tag) > 0:
+            print("Cannot use --resource, --tag, --csv or --select with the {0} command".format(
+                ctx.invoked_subcommand))
+            sys.exit(1)
+        return
+
     if csv and (len(resource) > 0 or len(tag) > 0):
         print("Cannot use --resource or --tag with --csv option")
         sys.exit(1)
-    if csv:
-        tagger = CSVResourceTagger(dryrun, verbose, role, region, tag_volumes=True)
-        tagger.tag(csv)
-    else:
-        tagger = MultipleResourceTagger(dryrun, verbose, role, region, tag_volumes=True)
-        tags = _tag_options_to_dict(tag)
-        tagger.tag(resource, tags)
+    if select and (csv or len(resource) > 0):
+        print("Cannot use --resource or --csv with --select option")
+        sys.exit(1)
+    if select and len(tag) == 0 and len(remove_tag) == 0:
+        print("The --select option requires at least one --tag or --remove-tag")
+        sys.exit(1)
+    if replace and not csv and len(tag) == 0:
+        print("The --replace option requires at least one --tag")
+        sys.exit(1)
+    if set(remove_tag) & set(_tag_options_to_dict(tag)):
+        print("Cannot use --tag and --remove-tag with the same key")
+        sys.exit(1)
+    if use_async and not csv:
+        print("The --async option requires the --csv option")
+        sys.exit(1)
+    if use_async and parallel_regions:
+        print("Cannot use --parallel-regions with --async option")
+        sys.exit(1)
+    if execute_plan_file and (csv or select or len(resource) > 0 or len(tag) > 0 or len(remove_tag) > 0 or replace
+                              or only_changed or plan_file or use_async):
+        print("Cannot use --resource, --tag, --csv, --select, --remove-tag, --replace, --only-changed, --plan or "
+              "--async with --execute-plan option")
+        sys.exit(1)
+    if plan_file and (checkpoint_file or resume or use_async):
+        print("Cannot use --checkpoint, --resume or --async with --plan option")
+        sys.exit(1)
+    if (checkpoint_file or resume) and not (csv or execute_plan_file):
+        print("The --checkpoint and --resume options require the --csv or --execute-plan option")
+        sys.exit(1)
+    if resume and not checkpoint_file and csv == '-':
+        print("Reading from stdin requires --checkpoint to be set when using --resume")
+        sys.exit(1)
+
+    _configure_metrics(metrics_log, metrics_summary, metrics_textfile, statsd)
+
+    selection = None
+    if select:
+        try:
+            selection = Selection.parse(select)
+        except ValueError as e:
+            print(e)
+            sys.exit(1)
+
+    propagate = _propagations(propagate, tag_volumes)
+
+    # only files are likely to list a resource more than once; merging holds rows back, so it is off otherwise
+    if coalesce_window is None:
+        coalesce_window = COALESCE_WINDOW if csv else 0
+
+    role_map = None
+    if role_map_file:
+        role_map = _load_role_map(role_map_file)
+
+    tag_cache = None
+    if cache_file:
+        tag_cache = TagCache(cache_file, ttl=cache_ttl)
+
+    plan = None
+    if execute_plan_file:
+        from .plan import load_plan
+        try:
+            plan = load_plan(execute_plan_file)
+        except ValueError as e:
+            print(e)
+            sys.exit(1)
+
+    checkpoint = None
+    if resume and not checkpoint_file:
+        checkpoint_file = (csv or execute_plan_file) + '.checkpoint'
+    if checkpoint_file:
+        checkpoint = Checkpoint(checkpoint_file, resume=resume)
+
+    try:
+        if plan_file:
+            from .plan import Planner, write_plan
+            planner = Planner(role, region, concurrency=concurrency, only_changed=only_changed, role_map=role_map,
+                              propagate=propagate, input_format=input_format, parallel_regions=parallel_regions,
+                              coalesce_window=coalesce_window, remove_tags=remove_tag, replace=replace)
+            if csv:
+                write_plan(planner.plan_file(csv), plan_file)
+            elif selection:
+                write_plan(planner.plan_selection(selection, _tag_options_to_dict(tag)), plan_file)
+            else:
+                write_plan(planner.plan_resources(resource, _tag_options_to_dict(tag)), plan_file)
+        elif plan:
+            from .plan import PlanResourceTagger
+            tagger = PlanResourceTagger(dryrun, verbose, plan, concurrency=concurrency, tag_cache=tag_cache,
+                                        checkpoint=checkpoint, parallel_regions=parallel_regions)
+            tagger.tag()
+        elif csv:
+            tagger_class = CSVResourceTagger
+            kwargs = {'parallel_regions': parallel_regions, 'coalesce_window': coalesce_window}
+            if use_async:
+                from .aio import AsyncCSVResourceTagger
+                tagger_class = AsyncCSVResourceTagger
+                kwargs = {'coalesce_window': coalesce_window}
+            kwargs.update(remove_tags=remove_tag, replace=replace)
+            tagger = tagger_class(dryrun, verbose, role, region, concurrency=concurrency, only_changed=only_changed,
+                                  tag_cache=tag_cache, checkpoint=checkpoint, role_map=role_map,
+                                  propagate=propagate, input_format=input_format, **kwargs)
+            tagger.tag(csv)
+        elif selection:
+            tagger = SelectResourceTagger(dryrun, verbose, role, region, concurrency=concurrency,
+                                          only_changed=only_changed, tag_cache=tag_cache, role_map=role_map,
+                                          propagate=propagate, parallel_regions=parallel_regions,
+                                          remove_tags=remove_tag, replace=replace)
+            tagger.tag(selection, _tag_options_to_dict(tag))
+        else:
+            tagger = MultipleResourceTagger(dryrun, verbose, role, region, concurrency=concurrency,
+                                            only_changed=only_changed, tag_cache=tag_cache, role_map=role_map,
+                                            propagate=propagate, parallel_regions=parallel_regions,
+                                            coalesce_window=coalesce_window, remove_tags=remove_tag,
+                                            replace=replace)
+            tags = _tag_options_to_dict(tag)
+            tagger.tag(resource, tags)
+    finally:
+        # writes the summary and textfile sinks
+        metrics.close()
+
+@cli.command()
+@click.option('--socket', 'socket_path', help='Unix socket to serve tag requests on, as lines of JSON.')
+@click.option('--port', type=click.IntRange(0, 65535), help='Port to serve tag requests on over HTTP.')
+@click.option('--host', default='127.0.0.1', show_default=True, help='Address to bind the HTTP port to.')
+@click.option('--batch-window', default=50, type=click.IntRange(0), show_default=True,
+              help='Milliseconds to wait after a request for others to tag in the same batch.')
+@click.pass_context
+def serve(ctx, socket_path, port, host, batch_window):
+    """Tag resources on request, as a long-running daemon.
+
+    Requests are JSON objects such as {"resources": ["i-0123456789abcdef0"], "tags": {"App": "web"}}, POSTed
+    to the HTTP port or written one per line to the Unix socket. Each is answered with the result for each of
+    its resources. The tagging options given before serve apply to every request."""
+    from .server import BatchingTagger, TaggingServer
+
+    if not socket_path and port is None:
+        print("The serve command requires --socket, --port or both")
+        sys.exit(1)
+
+    params = ctx.parent.params
+    _configure_metrics(params['metrics_log'], params['metrics_summary'], params['metrics_textfile'],
+                       params['statsd'])
+
+    role_map = None
+    if params['role_map_file']:
+        role_map = _load_role_map(params['role_map_file'])
+
+    tag_cache = None
+    if params['cache_file']:
+        tag_cache = TagCache(params['cache_file'], ttl=params['cache_ttl'])
+
+    try:
+        tagger = BatchingTagger(params['dryrun'], params['verbose'], params['role'], params['region'],
+                                concurrency=params['concurrency'], only_changed=params['only_changed'],
+                                tag_cache=tag_cache, role_map=role_map,
+                                propagate=_propagations(params['propagate'], params['tag_volumes']),
+                                remove_tags=params['remove_tag'], replace=params['replace'],
+                                batch_window=batch_window / 1000.0)
+        server = TaggingServer(tagger, verbose=params['verbose'])
+        signal.signal(signal.SIGTERM, lambda signum, frame: server.stop())
+        server.serve(socket_path=socket_path, host=host, port=port)
+    finally:
+        metrics.close()
+
+def _configure_metrics(metrics_log, metrics_summary, metrics_textfile, statsd):
+    sinks = []
+    if metrics_log:
+        sinks.append(metrics.JSONLinesSink(metrics_log))
+    if metrics_summary:
+        sinks.append(metrics.SummarySink())
+    if metrics_textfile:
+        sinks.append(metrics.PrometheusTextfileSink(metrics_textfile))
+    if statsd:
+        sinks.append(metrics.StatsDSink(statsd))
+    metrics.configure(sinks)
+
+def _propagations(propagate, tag_volumes):
+    # attached volumes are found by the propagation engine along with any other dependents
+    propagate = list(propagate)
+    if tag_volumes and 'volumes' not in propagate:
+        propagate.append('volumes')
+    return propagate
+
+def _load_role_map(role_map_file):
+    with open(role_map_file) as role_map_input:
+        role_map = json.load(role_map_input)
+    if not isinstance(role_map, dict) or not all(isinstance(role, str) for role in role_map.values()):
+        print("The --role-map file must be a JSON object mapping account IDs to role ARNs")
+        sys.exit(1)
+    return {str(account): role for (account, role) in role_map.items()}
 
 def _tag_options_to_dict(tag_options):
     tags = {}
@@ -1,7 +1,8 @@
 import botocore
 
-from tagger.base_tagger import is_retryable_exception, format_dict, dict_to_aws_tags, client
-from retrying import retry
+from tagger.base_tagger import adaptive_retry, format_dict, dict_to_aws_tags, client
+
+NOT_FOUND_ERRORS = ['NoSuchResource']
 
 class CloudfrontTagger(object):
     def __init__(self, dryrun, verbose, role=None, region=None):
@@ -17,11 +18,27 @@ class CloudfrontTagger(object):
             try:
                 self._cloudfront_tag_resource(Resource=resource_arn, Tags={'Items': aws_tags})
             except botocore.exceptions.ClientError as exception:
-                if exception.response["Error"]["Code"] in ['NoSuchResource']:
+                if exception.response["Error"]["Code"] in NOT_FOUND_ERRORS:
+                    print("Resource not found: %s" % resource_arn)
+                else:
+                    raise exception
+
+    def untag(self, resource_arn, keys):
+        if self.verbose:
+            print("untagging %s: %s" % (resource_arn, ", ".join(keys)))
+        if not self.dryrun:
+            try:
+                self._cloudfront_untag_resource(Resource=resource_arn, TagKeys={'Items': keys})
+            except botocore.exceptions.ClientError as exception:
+                if exception.response["Error"]["Code"] in NOT_FOUND_ERRORS:
                     print("Resource not found: %s" % resource_arn)
                 else:
                     raise exception
 
-    @retry(retry_on_exception=is_retryable_exception, stop_max_delay=30000, wait_exponential_multiplier=1000)
+    @adaptive_retry
     def _cloudfront_tag_resource(self, **kwargs):
-        return self.cloudfront.tag_resource(**kwargs)
\ No newline at end of file
+        return self.cloudfront.tag_resource(**kwargs)
+
+    @adaptive_retry
+    def _cloudfront_untag_resource(self, **kwargs):
+        return self.cloudfront.untag_resource(**kwargs)
@@ -1,7 +1,9 @@
 import botocore
 
-from tagger.base_tagger import is_retryable_exception, format_dict, client
-from retrying import retry
+from tagger.base_tagger import adaptive_retry, format_dict, client
+from tagger.utils import ResourceRef
+
+NOT_FOUND_ERRORS = ['ResourceNotFoundException']
 
 class CloudWatchLogsTagger(object):
     def __init__(self, dryrun, verbose, role=None, region=None):
@@ -12,24 +14,50 @@ class CloudWatchLogsTagger(object):
     def tag(self, resource_arn, tags):
         if self.verbose:
             print("tagging %s with %s" % (resource_arn, format_dict(tags)))
-        log_group = None
-        parts = resource_arn.split(':')
-        if len(parts) > 0:
-            log_group = parts[-1]
-
+        log_group = self._log_group(resource_arn)
         if not log_group:
-            print("Invalid ARN format for CloudWatch Logs: %s" % resource_arn)
             return
 
         if not self.dryrun:
             try:
                 self._logs_tag_log_group(logGroupName=log_group, tags=tags)
             except botocore.exceptions.ClientError as exception:
-                if exception.response["Error"]["Code"] in ['ResourceNotFoundException']:
+                if exception.response["Error"]["Code"] in NOT_FOUND_ERRORS:
                     print("Resource not found: %s" % resource_arn)
                 else:
                     raise exception
 
-    @retry(retry_on_exception=is_retryable_exception, stop_max_delay=30000, wait_exponential_multiplier=1000)
+    def untag(self, resource_arn, keys):
+        if self.verbose:
+            print("untagging %s: %s" % (resource_arn, ", ".join(keys)))
+        log_group = self._log_group(resource_arn)
+        if not log_group:
+            return
+
+        if not self.dryrun:
+            try:
+                self._logs_untag_log_group(logGroupName=log_group, tags=keys)
+            except botocore.exceptions.ClientError as exception:
+                if exception.response["Error"]["Code"] in NOT_FOUND_ERRORS:
+                    print("Resource not found: %s" % resource_arn)
+                else:
+                    raise exception
+
+    def _log_group(self, resource_arn):
+        log_group = None
+        arn = ResourceRef.parse(resource_arn)
+        if arn.resource_type == 'log-group':
+            # log group ARNs may end in :* to cover the group's streams
+            log_group = arn.id[:-2] if arn.id.endswith(':*') else arn.id
+
+        if not log_group:
+            print("Invalid ARN format for CloudWatch Logs: %s" % resource_arn)
+        return log_group
+
+    @adaptive_retry
     def _logs_tag_log_group(self, **kwargs):
-        return self.logs.tag_log_group(**kwargs)
\ No newline at end of file
+        return self.logs.tag_log_group(**kwargs)
+
+    @adaptive_retry
+    def _logs_untag_log_group(self, **kwargs):
+        return self.logs.untag_log_group(**kwargs)
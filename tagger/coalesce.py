@@ -0,0 +1,74 @@
+import collections
+import threading
+
+from .utils import intern_tags
+
+# distinct resources whose rows are held back at a time, waiting for more rows for the same resource
+COALESCE_WINDOW = 10000
+
+
+class Coalescer(object):
+    """Merges the rows for the same resource into a single row, so each resource gets one write. Rows are
+    held back until `window` other resources have been seen since the resource first appeared, or the input
+    ends; a resource that shows up again after that is written again. Later rows win where tags conflict,
+    and each conflict is reported.
+
+    key(row) returns what identifies a row's resource. With track_numbers, the numbers of the rows merged
+    away are remembered so that a checkpoint can record them once the row they went into is tagged."""
+
+    def __init__(self, key, window=COALESCE_WINDOW, track_numbers=False):
+        self.key = key
+        self.window = window
+        self.track_numbers = track_numbers
+        # row number -> numbers of the rows merged into that row
+        self.merged = {}
+        self.merged_rows = 0
+        self.conflicts = 0
+        self.lock = threading.Lock()
+
+    def coalesce(self, rows):
+        pending = collections.OrderedDict()
+        for row in rows:
+            key = self.key(row)
+            entry = pending.get(key)
+            if entry is None:
+                # the tags are only copied once another row for the resource turns up
+                pending[key] = (row, None, [])
+                if len(pending) > self.window:
+                    yield self._merged_row(*pending.popitem(last=False)[1])
+                continue
+
+            first, tags, numbers = entry
+            if tags is None:
+                tags = dict(first.tags)
+                pending[key] = (first, tags, numbers)
+            for (tag_key, value) in row.tags.items():
+                if tag_key in tags and tags[tag_key] != value:
+                    print("Conflicting values for tag {0} of {1}: {2} replaced by {3}".format(
+                        tag_key, row.resource_id, tags[tag_key], value))
+                    with self.lock:
+                        self.conflicts += 1
+            tags.update(row.tags)
+            if row.number is not None:
+                numbers.append(row.number)
+            with self.lock:
+                self.merged_rows += 1
+
+        while pending:
+            yield self._merged_row(*pending.popitem(last=False)[1])
+
+    def _merged_row(self, row, tags, numbers):
+        if self.track_numbers and numbers and row.number is not None:
+            with self.lock:
+                self.merged[row.number] = numbers
+        if tags is None:
+            return row
+        return row._replace(tags=intern_tags(tags))
+
+    def merged_into(self, number):
+        """Returns, once, the numbers of the rows merged into row `number`."""
+        with self.lock:
+            return self.merged.pop(number, ())
+
+    def summary(self):
+        return "{0} duplicate rows merged, {1} conflicting tags".format(self.merged_rows, self.conflicts)
@@ -0,0 +1,104 @@
+import collections
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+class ThreadLocalOutput(object):
+    """Stands in for sys.stdout so that output written by worker threads is captured per task."""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.local = threading.local()
+
+    def write(self, text):
+        buffer = getattr(self.local, 'buffer', None)
+        if buffer is None:
+            self.stream.write(text)
+        else:
+            buffer.append(text)
+
+    def flush(self):
+        self.stream.flush()
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+
+def capture_output(output, fn, *args):
+    """Calls fn, returning what it printed to the ThreadLocalOutput instead of writing it out."""
+    buffer = []
+    output.local.buffer = buffer
+    try:
+        fn(*args)
+    finally:
+        output.local.buffer = None
+    return ''.join(buffer)
+
+
+class ConcurrentRunner(object):
+    """Runs tasks on a thread pool per lane, a lane usually being a (service, region) pair, so that a
+    throttled service never holds up the others. Output is replayed in submission order so that it reads
+    the same as a sequential run. With a concurrency of 1 tasks run inline. A runner on a thread whose
+    output is already being captured is given that ThreadLocalOutput, and replays into it instead of
+    replacing sys.stdout."""
+
+    def __init__(self, concurrency=1, max_pending=None, output=None):
+        self.concurrency = concurrency
+        self.max_pending = max_pending or concurrency * 64
+        self.lanes = {}
+        self.pending = collections.deque()
+        self.shared_output = output
+        self.output = None
+
+    def __enter__(self):
+        if self.concurrency > 1:
+            if self.shared_output is not None:
+                self.output = self.shared_output
+            else:
+                self.output = ThreadLocalOutput(sys.stdout)
+                sys.stdout = self.output
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            if exc_type is None:
+                self.drain()
+            else:
+                # a task failed: let the ones already running finish but start no more
+                for future in self.pending:
+                    future.cancel()
+        finally:
+            for executor in self.lanes.values():
+                executor.shutdown(wait=True)
+            self.lanes = {}
+            if self.output is not None and self.shared_output is None:
+                sys.stdout = self.output.stream
+            self.output = None
+
+    def submit(self, lane, fn, *args):
+        if self.output is None:
+            fn(*args)
+            return
+
+        executor = self.lanes.get(lane)
+        if executor is None:
+            executor = ThreadPoolExecutor(max_workers=self.concurrency)
+            self.lanes[lane] = executor
+        self.pending.append(executor.submit(capture_output, self.output, fn, *args))
+
+        self._emit_completed()
+        while len(self.pending) > self.max_pending:
+            self._emit(self.pending.popleft())
+
+    def drain(self):
+        while self.pending:
+            self._emit(self.pending.popleft())
+
+    def _emit_completed(self):
+        while self.pending and self.pending[0].done():
+            self._emit(self.pending.popleft())
+
+    def _emit(self, future):
+        # written on the submitting thread, so a shared output captures it
+        self.output.write(future.result())
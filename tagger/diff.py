@@ -0,0 +1,126 @@
+import threading
+
+from .utils import intern_tags
+
+# rows whose current tags are read together before deciding which of them need a write
+DIFF_WINDOW = 100
+
+
+def diff_tags(current, desired, replace=False):
+    """Returns the subset of desired that differs from current, with the number of tags added, updated and
+    removed. A tag whose desired value is None is removed if present; with replace, so is every tag of current
+    that desired leaves out."""
+    changed = {}
+    added = 0
+    updated = 0
+    removed = 0
+    for (key, value) in desired.items():
+        if key.startswith('aws:'):
+            continue
+        if value is None:
+            if key not in current:
+                continue
+            removed += 1
+        elif key not in current:
+            added += 1
+        elif current[key] != value:
+            updated += 1
+        else:
+            continue
+        changed[key] = value
+
+    if replace:
+        for key in current:
+            if key not in desired and not key.startswith('aws:'):
+                changed[key] = None
+                removed += 1
+
+    return changed, added, updated, removed
+
+
+class DiffStats(object):
+    def __init__(self):
+        self.unchanged = 0
+        self.unread = 0
+        self.updated = 0
+        self.added = 0
+        self.removed = 0
+        self.lock = threading.Lock()
+
+    def count(self, added, updated, removed=0):
+        with self.lock:
+            if added == 0 and updated == 0 and removed == 0:
+                self.unchanged += 1
+            self.added += added
+            self.updated += updated
+            self.removed += removed
+
+    def count_unread(self):
+        with self.lock:
+            self.unread += 1
+
+    def summary(self):
+        summary = "{0} resources unchanged, {1} tags updated, {2} tags added".format(
+            self.unchanged, self.updated, self.added)
+        if self.removed:
+            summary += ", {0} tags removed".format(self.removed)
+        if self.unread:
+            summary += ", {0} resources written without reading their tags".format(self.unread)
+        return summary
+
+
+def changed_rows(rows, lookup_tagger, stats, window=DIFF_WINDOW, on_unchanged=None, replace=False,
+                 removals_only=False):
+    """Filters Rows down to those whose tags differ from what is already on the resource, reading current
+    tags in bulk a window of rows at a time. Rows that remain carry only the tags that need writing, and None
+    for those that need removing; rows that are dropped are passed to on_unchanged. With replace, tags a row
+    does not name are removed from its resource. With removals_only, only the rows removing tags are read,
+    only the removals of keys their resources do not have are dropped, and nothing is counted in stats."""
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= window:
+            for changed in _diff_batch(batch, lookup_tagger, stats, on_unchanged, replace, removals_only):
+                yield changed
+            batch = []
+
+    for changed in _diff_batch(batch, lookup_tagger, stats, on_unchanged, replace, removals_only):
+        yield changed
+
+
+def _diff_batch(batch, lookup_tagger, stats, on_unchanged, replace, removals_only):
+    by_tagger = {}
+    row_taggers = []
+    for row in batch:
+        tagger = None
+        if not removals_only or None in row.tags.values():
+            tagger = lookup_tagger(row.ref, row.region)
+            by_tagger.setdefault(id(tagger), (tagger, {}))[1][row.resource_id] = row.ref
+        row_taggers.append(tagger)
+
+    current = {}
+    for (tagger, refs) in by_tagger.values():
+        current[id(tagger)] = tagger.read_tags(refs.values())
+
+    for (row, tagger) in zip(batch, row_taggers):
+        if tagger is None:
+            yield row
+            continue
+
+        existing = current[id(tagger)].get(row.resource_id)
+        if existing is None:
+            # current tags could not be read, so write them all
+            if not removals_only:
+                stats.count_unread()
+            yield row
+            continue
+
+        if removals_only:
+            changed = {key: value for (key, value) in row.tags.items() if value is not None or key in existing}
+        else:
+            changed, added, updated, removed = diff_tags(existing, row.tags, replace)
+            stats.count(added, updated, removed)
+        if changed:
+            yield row._replace(tags=intern_tags(changed))
+        elif on_unchanged is not None:
+            on_unchanged(row)
@@ -1,52 +1,131 @@
+import threading
+
 import botocore
 
-from tagger.base_tagger import is_retryable_exception, format_dict, dict_to_aws_tags, client
-from retrying import retry
+from tagger.base_tagger import adaptive_retry, format_dict, dict_to_aws_tags, tag_set_key, client
+from tagger.utils import chunks
+
+# CreateTags and DeleteTags accept at most 1000 resource IDs per call
+MAX_CREATE_TAGS_RESOURCES = 1000
+
+NOT_FOUND_ERRORS = ['InvalidSnapshot.NotFound', 'InvalidVolume.NotFound', 'InvalidInstanceID.NotFound']
+
+# resource IDs per describe_tags filter
+INSTANCE_FILTER_SIZE = 200
 
 class EC2Tagger(object):
-    def __init__(self, dryrun, verbose, role=None, region=None, tag_volumes=False):
+    def __init__(self, dryrun, verbose, role=None, region=None, batch=False):
         self.dryrun = dryrun
         self.verbose = verbose
+        self.batch = batch
         self.ec2 = client('ec2', role=role, region=region)
-        self.volume_cache = {}
-        if tag_volumes:
-            self.add_volume_cache()
-
-    def add_volume_cache(self):
-        #TODO implement paging for describe instances
-        reservations = self._ec2_describe_instances(MaxResults=1000)
-
-        for reservation in reservations["Reservations"]:
-            for instance in reservation["Instances"]:
-                instance_id = instance['InstanceId']
-                volumes = instance.get('BlockDeviceMappings', [])
-                self.volume_cache[instance_id] = []
-                for volume in volumes:
-                    ebs = volume.get('Ebs', {})
-                    volume_id = ebs.get('VolumeId')
-                    if volume_id:
-                        self.volume_cache[instance_id].append(volume_id)
+        self.pending = {}
+        # tag keys -> (keys, IDs) to remove them from at the next flush
+        self.removals = {}
+        self.pending_lock = threading.Lock()
 
     def tag(self, instance_id, tags):
-        aws_tags = dict_to_aws_tags(tags)
-        resource_ids = [instance_id]
-        resource_ids.extend(self.volume_cache.get(instance_id, []))
+        if self.batch:
+            key = tag_set_key(tags)
+            with self.pending_lock:
+                if key not in self.pending:
+                    self.pending[key] = (key, [])
+                self.pending[key][1].append(instance_id)
+            return
+
+        if self.verbose:
+            print("tagging %s with %s" % (instance_id, format_dict(tags)))
+        if not self.dryrun:
+            self._apply(self._ec2_create_tags, instance_id, dict_to_aws_tags(tags))
+
+    def untag(self, instance_id, keys):
+        if self.batch:
+            with self.pending_lock:
+                if tuple(keys) not in self.removals:
+                    self.removals[tuple(keys)] = (list(keys), [])
+                self.removals[tuple(keys)][1].append(instance_id)
+            return
+
         if self.verbose:
-            print("tagging %s with %s" % (", ".join(resource_ids), format_dict(tags)))
+            print("untagging %s: %s" % (instance_id, ", ".join(keys)))
         if not self.dryrun:
+            self._apply(self._ec2_delete_tags, instance_id, [{'Key': key} for key in keys])
+
+    def flush(self):
+        """Sends batched tags and removals, returning the IDs tagged and (ID, exception) pairs for failures. An
+        ID is only reported tagged once everything queued for it went through."""
+        with self.pending_lock:
+            pending = self.pending
+            removals = self.removals
+            self.pending = {}
+            self.removals = {}
+
+        tagged = []
+        failed = []
+        for (tags, instance_ids) in pending.values():
+            self._send(self._ec2_create_tags, instance_ids, dict_to_aws_tags(tags),
+                       ("tagging", " with " + format_dict(tags)), tagged, failed)
+        for (keys, instance_ids) in removals.values():
+            # a key without a value is removed whatever its value
+            self._send(self._ec2_delete_tags, instance_ids, [{'Key': key} for key in keys],
+                       ("untagging", ": " + ", ".join(keys)), tagged, failed)
+
+        failed_ids = set(instance_id for (instance_id, _) in failed)
+        return [instance_id for instance_id in dict.fromkeys(tagged) if instance_id not in failed_ids], failed
+
+    def read_tags(self, resource_ids):
+        """Returns the current tags of each resource, looked up INSTANCE_FILTER_SIZE IDs at a time."""
+        current = {resource_id: {} for resource_id in resource_ids}
+        for batch in chunks(sorted(current), INSTANCE_FILTER_SIZE):
+            kwargs = {'Filters': [{'Name': 'resource-id', 'Values': batch}], 'MaxResults': 1000}
+            while True:
+                response = self._ec2_describe_tags(**kwargs)
+                for tag in response['Tags']:
+                    current.setdefault(tag['ResourceId'], {})[tag['Key']] = tag['Value']
+
+                if not response.get('NextToken'):
+                    break
+                kwargs['NextToken'] = response['NextToken']
+
+        return current
+
+    def _send(self, operation, instance_ids, aws_tags, description, tagged, failed):
+        for batch in chunks(instance_ids, MAX_CREATE_TAGS_RESOURCES):
+            if self.verbose:
+                print("%s %s%s" % (description[0], ", ".join(batch), description[1]))
+            if self.dryrun:
+                tagged.extend(batch)
+                continue
+
             try:
-                self._ec2_create_tags(Resources=resource_ids, Tags=aws_tags)
-            except botocore.exceptions.ClientError as exception:
-                if exception.response["Error"]["Code"] in ['InvalidSnapshot.NotFound', 'InvalidVolume.NotFound', 'InvalidInstanceID.NotFound']:
-                    print("Resource not found: %s" % instance_id)
-                else:
-                    raise exception
+                operation(Resources=batch, Tags=aws_tags)
+                tagged.extend(batch)
+            except botocore.exceptions.ClientError:
+                # one bad ID fails the whole call, so retry each ID on its own to report failures per ID
+                for instance_id in batch:
+                    try:
+                        self._apply(operation, instance_id, aws_tags)
+                        tagged.append(instance_id)
+                    except botocore.exceptions.ClientError as exception:
+                        failed.append((instance_id, exception))
 
+    def _apply(self, operation, instance_id, aws_tags):
+        try:
+            operation(Resources=[instance_id], Tags=aws_tags)
+        except botocore.exceptions.ClientError as exception:
+            if exception.response["Error"]["Code"] in NOT_FOUND_ERRORS:
+                print("Resource not found: %s" % instance_id)
+            else:
+                raise exception
 
-    @retry(retry_on_exception=is_retryable_exception, stop_max_delay=30000, wait_exponential_multiplier=1000)
-    def _ec2_describe_instances(self, **kwargs):
-        return self.ec2.describe_instances(**kwargs)
+    @adaptive_retry
+    def _ec2_describe_tags(self, **kwargs):
+        return self.ec2.describe_tags(**kwargs)
 
-    @retry(retry_on_exception=is_retryable_exception, stop_max_delay=30000, wait_exponential_multiplier=1000)
+    @adaptive_retry
     def _ec2_create_tags(self, **kwargs):
-        return self.ec2.create_tags(**kwargs)
\ No newline at end of file
+        return self.ec2.create_tags(**kwargs)
+
+    @adaptive_retry
+    def _ec2_delete_tags(self, **kwargs):
+        return self.ec2.delete_tags(**kwargs)
@@ -1,7 +1,8 @@
 import botocore
 
-from tagger.base_tagger import is_retryable_exception, _arn_to_name, format_dict, dict_to_aws_tags, client
-from retrying import retry
+from tagger.base_tagger import adaptive_retry, _arn_to_name, format_dict, dict_to_aws_tags, client
+
+NOT_FOUND_ERRORS = ['FileSystemNotFound']
 
 class EFSTagger(object):
     def __init__(self, dryrun, verbose, role=None, region=None):
@@ -19,11 +20,28 @@ class EFSTagger(object):
             try:
                 self._efs_create_tags(FileSystemId=file_system_id, Tags=aws_tags)
             except botocore.exceptions.ClientError as exception:
-                if exception.response["Error"]["Code"] in ['FileSystemNotFound']:
+                if exception.response["Error"]["Code"] in NOT_FOUND_ERRORS:
                     print("Resource not found: %s" % resource_arn)
                 else:
                     raise exception
 
-    @retry(retry_on_exception=is_retryable_exception, stop_max_delay=30000, wait_exponential_multiplier=1000)
+    def untag(self, resource_arn, keys):
+        file_system_id = _arn_to_name(resource_arn)
+        if self.verbose:
+            print("untagging %s: %s" % (file_system_id, ", ".join(keys)))
+        if not self.dryrun:
+            try:
+                self._efs_delete_tags(FileSystemId=file_system_id, TagKeys=keys)
+            except botocore.exceptions.ClientError as exception:
+                if exception.response["Error"]["Code"] in NOT_FOUND_ERRORS:
+                    print("Resource not found: %s" % resource_arn)
+                else:
+                    raise exception
+
+    @adaptive_retry
     def _efs_create_tags(self, **kwargs):
-        return self.efs.create_tags(**kwargs)
\ No newline at end of file
+        return self.efs.create_tags(**kwargs)
+
+    @adaptive_retry
+    def _efs_delete_tags(self, **kwargs):
+        return self.efs.delete_tags(**kwargs)
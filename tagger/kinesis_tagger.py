@@ -1,7 +1,8 @@
 import botocore
 
-from tagger.base_tagger import is_retryable_exception, _arn_to_name, format_dict, client
-from retrying import retry
+from tagger.base_tagger import adaptive_retry, _arn_to_name, format_dict, client
+
+NOT_FOUND_ERRORS = ['ResourceNotFoundException']
 
 class KinesisTagger(object):
     def __init__(self, dryrun, verbose, role=None, region=None):
@@ -17,11 +18,28 @@ class KinesisTagger(object):
                 stream_name = _arn_to_name(resource_arn)
                 self._kinesis_add_tags_to_stream(StreamName=stream_name, Tags=tags)
             except botocore.exceptions.ClientError as exception:
-                if exception.response["Error"]["Code"] in ['ResourceNotFoundException']:
+                if exception.response["Error"]["Code"] in NOT_FOUND_ERRORS:
                     print("Resource not found: %s" % resource_arn)
                 else:
                     raise exception
 
-    @retry(retry_on_exception=is_retryable_exception, stop_max_delay=30000, wait_exponential_multiplier=1000)
+    def untag(self, resource_arn, keys):
+        if self.verbose:
+            print("untagging %s: %s" % (resource_arn, ", ".join(keys)))
+        if not self.dryrun:
+            try:
+                stream_name = _arn_to_name(resource_arn)
+                self._kinesis_remove_tags_from_stream(StreamName=stream_name, TagKeys=keys)
+            except botocore.exceptions.ClientError as exception:
+                if exception.response["Error"]["Code"] in NOT_FOUND_ERRORS:
+                    print("Resource not found: %s" % resource_arn)
+                else:
+                    raise exception
+
+    @adaptive_retry
     def _kinesis_add_tags_to_stream(self, **kwargs):
-        return self.kinesis.add_tags_to_stream(**kwargs)
\ No newline at end of file
+        return self.kinesis.add_tags_to_stream(**kwargs)
+
+    @adaptive_retry
+    def _kinesis_remove_tags_from_stream(self, **kwargs):
+        return self.kinesis.remove_tags_from_stream(**kwargs)
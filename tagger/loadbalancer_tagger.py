@@ -1,7 +1,8 @@
 import botocore
 
-from tagger.base_tagger import is_retryable_exception, _arn_to_name, format_dict, dict_to_aws_tags, client
-from retrying import retry
+from tagger.base_tagger import adaptive_retry, _arn_to_name, format_dict, dict_to_aws_tags, client
+
+NOT_FOUND_ERRORS = ['LoadBalancerNotFound']
 
 class LBTagger(object):
     def __init__(self, dryrun, verbose, role=None, region=None):
@@ -25,15 +26,39 @@ class LBTagger(object):
                     elb_name = _arn_to_name(resource_arn)
                     self._elb_add_tags(LoadBalancerNames=[elb_name], Tags=aws_tags)
             except botocore.exceptions.ClientError as exception:
-                if exception.response["Error"]["Code"] in ['LoadBalancerNotFound']:
+                if exception.response["Error"]["Code"] in NOT_FOUND_ERRORS:
                     print("Resource not found: %s" % resource_arn)
                 else:
                     raise exception
 
-    @retry(retry_on_exception=is_retryable_exception, stop_max_delay=30000, wait_exponential_multiplier=1000)
+    def untag(self, resource_arn, keys):
+        if self.verbose:
+            print("untagging %s: %s" % (resource_arn, ", ".join(keys)))
+        if not self.dryrun:
+            try:
+                if ':loadbalancer/app/' in resource_arn or ':loadbalancer/net/' in resource_arn:
+                    self._alb_remove_tags(ResourceArns=[resource_arn], TagKeys=keys)
+                else:
+                    elb_name = _arn_to_name(resource_arn)
+                    self._elb_remove_tags(LoadBalancerNames=[elb_name], Tags=[{'Key': key} for key in keys])
+            except botocore.exceptions.ClientError as exception:
+                if exception.response["Error"]["Code"] in NOT_FOUND_ERRORS:
+                    print("Resource not found: %s" % resource_arn)
+                else:
+                    raise exception
+
+    @adaptive_retry
     def _elb_add_tags(self, **kwargs):
         return self.elb.add_tags(**kwargs)
 
-    @retry(retry_on_exception=is_retryable_exception, stop_max_delay=30000, wait_exponential_multiplier=1000)
+    @adaptive_retry
     def _alb_add_tags(self, **kwargs):
-        return self.alb.add_tags(**kwargs)
\ No newline at end of file
+        return self.alb.add_tags(**kwargs)
+
+    @adaptive_retry
+    def _elb_remove_tags(self, **kwargs):
+        return self.elb.remove_tags(**kwargs)
+
+    @adaptive_retry
+    def _alb_remove_tags(self, **kwargs):
+        return self.alb.remove_tags(**kwargs)
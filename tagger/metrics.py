@@ -0,0 +1,280 @@
+import json
+import os
+import socket
+import sys
+import threading
+import time
+
+# request parameters holding the resources a call acts on, used as its batch size
+BATCH_PARAMETERS = ['Resources', 'ResourceARNList', 'ResourceArns', 'LoadBalancerNames', 'ResourceIds',
+                    'InstanceIds']
+
+
+class Call(object):
+    """One AWS call as the tagger made it: all its attempts, including retries and rate limiter waits."""
+    __slots__ = ('service', 'operation', 'region', 'started', 'latency', 'attempts', 'throttles', 'batch_size',
+                 'error', 'parent')
+
+    def __init__(self):
+        self.service = None
+        self.operation = None
+        self.region = None
+        self.started = time.time()
+        self.latency = 0.0
+        self.attempts = 0
+        self.throttles = 0
+        self.batch_size = None
+        self.error = None
+        self.parent = None
+
+    def as_dict(self):
+        return {
+            'time': self.started,
+            'service': self.service,
+            'operation': self.operation,
+            'region': self.region,
+            'latency_ms': round(self.latency * 1000, 3),
+            'attempts': self.attempts,
+            'throttles': self.throttles,
+            'batch_size': self.batch_size,
+            'error': self.error,
+        }
+
+
+class NullSink(object):
+    def record(self, call):
+        pass
+
+    def close(self):
+        pass
+
+
+class JSONLinesSink(object):
+    """Writes each call as a JSON object on its own line."""
+
+    def __init__(self, path):
+        self.output = open(path, 'a')
+        self.lock = threading.Lock()
+
+    def record(self, call):
+        line = json.dumps(call.as_dict(), sort_keys=True)
+        with self.lock:
+            self.output.write(line + '\n')
+
+    def close(self):
+        with self.lock:
+            self.output.close()
+
+
+class Totals(object):
+    """Calls, retries, throttles, errors and latency per service, operation and region."""
+
+    def __init__(self):
+        self.totals = {}
+        self.lock = threading.Lock()
+
+    def record(self, call):
+        key = (call.service or '-', call.operation or '-', call.region or '-')
+        with self.lock:
+            totals = self.totals.get(key)
+            if totals is None:
+                totals = {'calls': 0, 'retries': 0, 'throttles': 0, 'errors': 0, 'resources': 0, 'latencies': []}
+                self.totals[key] = totals
+            totals['calls'] += 1
+            totals['retries'] += max(call.attempts - 1, 0)
+            totals['throttles'] += call.throttles
+            totals['errors'] += 1 if call.error else 0
+            totals['resources'] += call.batch_size or 0
+            totals['latencies'].append(call.latency)
+
+    def items(self):
+        with self.lock:
+            return sorted((key, dict(totals, latencies=sorted(totals['latencies'])))
+                          for (key, totals) in self.totals.items())
+
+
+def _percentile(latencies, fraction):
+    if not latencies:
+        return 0.0
+    return latencies[min(len(latencies) - 1, int(fraction * len(latencies)))]
+
+
+class SummarySink(Totals):
+    """Prints a table of the run's AWS calls when the run ends."""
+
+    def __init__(self, stream=None):
+        super(SummarySink, self).__init__()
+        self.stream = stream
+
+    def close(self):
+        stream = self.stream or sys.stdout
+        stream.write("{0:<26} {1:<24} {2:<15} {3:>7} {4:>7} {5:>9} {6:>6} {7:>9} {8:>9} {9:>9}\n".format(
+            'service', 'operation', 'region', 'calls', 'retries', 'throttles', 'errors', 'resources', 'p50 ms',
+            'p99 ms'))
+        for ((service, operation, region), totals) in self.items():
+            stream.write("{0:<26} {1:<24} {2:<15} {3:>7} {4:>7} {5:>9} {6:>6} {7:>9} {8:>9.1f} {9:>9.1f}\n".format(
+                service, operation, region, totals['calls'], totals['retries'], totals['throttles'],
+                totals['errors'], totals['resources'], _percentile(totals['latencies'], 0.5) * 1000,
+                _percentile(totals['latencies'], 0.99) * 1000))
+
+
+class PrometheusTextfileSink(Totals):
+    """Writes the run's totals in the Prometheus text format when the run ends, for the node exporter's
+    textfile collector. The file is replaced atomically so the collector never reads half of it."""
+
+    METRICS = [
+        ('aws_tagger_api_calls_total', 'calls', 'AWS API calls made.'),
+        ('aws_tagger_api_retries_total', 'retries', 'AWS API calls retried.'),
+        ('aws_tagger_api_throttles_total', 'throttles', 'AWS API calls throttled.'),
+        ('aws_tagger_api_errors_total', 'errors', 'AWS API calls that failed.'),
+        ('aws_tagger_api_resources_total', 'resources', 'Resources named in batched AWS API calls.'),
+    ]
+
+    def __init__(self, path):
+        super(PrometheusTextfileSink, self).__init__()
+        self.path = path
+
+    def close(self):
+        items = self.items()
+        lines = []
+        for (name, field, description) in self.METRICS:
+            lines.append('# HELP %s %s' % (name, description))
+            lines.append('# TYPE %s counter' % name)
+            for (key, totals) in items:
+                lines.append('%s{%s} %d' % (name, self._labels(key), totals[field]))
+
+        lines.append('# HELP aws_tagger_api_latency_seconds Time spent in AWS API calls, retries included.')
+        lines.append('# TYPE aws_tagger_api_latency_seconds summary')
+        for (key, totals) in items:
+            labels = self._labels(key)
+            for quantile in (0.5, 0.99):
+                lines.append('aws_tagger_api_latency_seconds{%s,quantile="%s"} %f'
+                             % (labels, quantile, _percentile(totals['latencies'], quantile)))
+            lines.append('aws_tagger_api_latency_seconds_sum{%s} %f' % (labels, sum(totals['latencies'])))
+            lines.append('aws_tagger_api_latency_seconds_count{%s} %d' % (labels, len(totals['latencies'])))
+
+        temporary = '%s.%d.tmp' % (self.path, os.getpid())
+        with open(temporary, 'w') as output:
+            output.write('\n'.join(lines) + '\n')
+        os.rename(temporary, self.path)
+
+    @staticmethod
+    def _labels(key):
+        return 'service="%s",operation="%s",region="%s"' % key
+
+
+class StatsDSink(object):
+    """Sends counters and timings for each call to a StatsD daemon over UDP. Sending never blocks or fails
+    the run; packets that cannot be sent are dropped."""
+
+    def __init__(self, address, prefix='aws_tagger'):
+        host, port = address, 8125
+        if ':' in address:
+            host, port = address.rsplit(':', 1)
+        self.address = (host or 'localhost', int(port))
+        self.prefix = prefix
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def record(self, call):
+        name = '%s.api.%s.%s' % (self.prefix, call.service or 'unknown', call.operation or 'unknown')
+        lines = ['%s.calls:1|c' % name, '%s.latency:%d|ms' % (name, call.latency * 1000)]
+        if call.attempts > 1:
+            lines.append('%s.retries:%d|c' % (name, call.attempts - 1))
+        if call.throttles:
+            lines.append('%s.throttles:%d|c' % (name, call.throttles))
+        if call.error:
+            lines.append('%s.errors:1|c' % name)
+        try:
+            self.socket.sendto('\n'.join(lines).encode('utf-8'), self.address)
+        except OSError:
+            pass
+
+    def close(self):
+        self.socket.close()
+
+
+class MultiSink(object):
+    def __init__(self, sinks):
+        self.sinks = sinks
+
+    def record(self, call):
+        for sink in self.sinks:
+            sink.record(call)
+
+    def close(self):
+        for sink in self.sinks:
+            sink.close()
+
+
+NULL_SINK = NullSink()
+sink = NULL_SINK
+_local = threading.local()
+
+
+def configure(sinks):
+    """Sends every AWS call made from now on to the sinks. With no sinks, calls are not instrumented."""
+    global sink
+    if not sinks:
+        sink = NULL_SINK
+    elif len(sinks) == 1:
+        sink = sinks[0]
+    else:
+        sink = MultiSink(sinks)
+
+
+def enabled():
+    return sink is not NULL_SINK
+
+
+def close():
+    global sink
+    closing, sink = sink, NULL_SINK
+    closing.close()
+
+
+def start_call():
+    """Starts measuring a call on this thread. Calls may nest, e.g. when credentials are refreshed in the
+    middle of another call, so each remembers the one it interrupted."""
+    call = Call()
+    call.parent = getattr(_local, 'call', None)
+    _local.call = call
+    return call
+
+
+def end_call(call, error=None):
+    _local.call = call.parent
+    call.latency = time.time() - call.started
+    if error is not None:
+        call.error = getattr(error, 'response', {}).get('Error', {}).get('Code') or type(error).__name__
+    sink.record(call)
+
+
+def instrument(aws_client):
+    """Fills in the service, operation, region and batch size of the call in progress on each attempt made
+    through the client, and counts the attempts."""
+    service = aws_client.meta.service_model.service_name
+    region = aws_client.meta.region_name
+
+    def _parameters(params, **kwargs):
+        # the keyword arguments the call was made with; by before-call they have been serialized
+        call = getattr(_local, 'call', None)
+        if call is None or call.batch_size is not None:
+            return
+        for name in BATCH_PARAMETERS:
+            if name in params:
+                call.batch_size = len(params[name])
+                break
+
+    def _attempt(model, **kwargs):
+        call = getattr(_local, 'call', None)
+        if call is None:
+            return
+        call.attempts += 1
+        if call.operation is None:
+            call.service = service
+            call.operation = model.name
+            call.region = region
+
+    aws_client.meta.events.register('provide-client-params', _parameters)
+    aws_client.meta.events.register('before-call', _attempt)
+    return aws_client
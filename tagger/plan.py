@@ -0,0 +1,343 @@
+import collections
+import json
+import math
+import sys
+
+from .base_tagger import split_removals, tag_set_key
+from .coalesce import COALESCE_WINDOW
+from .diff import DIFF_WINDOW
+from .ec2_tagger import INSTANCE_FILTER_SIZE, MAX_CREATE_TAGS_RESOURCES
+from .propagation import FILTER_SIZE, FULL_SCAN_THRESHOLD, INSTANCES_PAGE_SIZE
+from .readers import Row, bounded
+from .resource_groups_tagger import MAX_GET_RESOURCES_ARNS, MAX_TAG_RESOURCES_ARNS, ResourceGroupsTagger
+from .selection import ResourceSelector
+from .tagger import FLUSH_INTERVAL, TAGGER_CLASSES, CSVResourceTagger, route
+from .throttle import DEFAULT_RATE_LIMIT, GLOBAL_SERVICES, OPERATION_RATE_LIMITS, RATE_LIMITS
+from .utils import ResourceRef, intern_tags
+
+# bumped whenever a saved plan would no longer be executed the same way
+PLAN_VERSION = 1
+
+# seconds a typical tagging call takes, for the part of a run that is not spent waiting on a rate limit
+CALL_LATENCY = 0.1
+
+# the client and the operations a service's own tagger adds and removes tags with, one resource a call
+SERVICE_OPERATIONS = {
+    'elasticfilesystem': ('efs', 'CreateTags', 'DeleteTags'),
+    'rds': ('rds', 'AddTagsToResource', 'RemoveTagsFromResource'),
+    'elasticloadbalancing': ('elbv2', 'AddTags', 'RemoveTags'),
+    'elasticache': ('elasticache', 'AddTagsToResource', 'RemoveTagsFromResource'),
+    'es': ('es', 'AddTags', 'RemoveTags'),
+    'kinesis': ('kinesis', 'AddTagsToStream', 'RemoveTagsFromStream'),
+    'cloudfront': ('cloudfront', 'TagResource', 'UntagResource'),
+    'logs': ('logs', 'TagLogGroup', 'UntagLogGroup'),
+    'dynamodb': ('dynamodb', 'TagResource', 'UntagResource'),
+    'lambda': ('lambda', 'TagResource', 'UntagResource'),
+    'acm-pca': ('acm-pca', 'TagCertificateAuthority', 'UntagCertificateAuthority'),
+    'route53': ('route53', 'ChangeTagsForResource', 'ChangeTagsForResource'),
+}
+
+
+class Planner(CSVResourceTagger):
+    """Works out what tagging a set of rows takes without creating a client or assuming a role: the
+    resources grouped by account, role, region, service and tag set, the calls each AWS API would get and
+    how long the rate limits in throttle would make them take. Removals and the merging of duplicate rows
+    are applied as they would be when tagging. Dependents found by propagation, the rows --only-changed
+    or --replace would drop and the removals of keys a resource does not have depend on what is in AWS, so
+    the calls writing them are an upper bound and dependents other than volumes are not counted.
+
+    The plan is a dict, ready for json.dump, that PlanResourceTagger executes as it stands."""
+
+    def __init__(self, role=None, region=None, concurrency=1, only_changed=False, role_map=None, propagate=None,
+                 input_format=None, parallel_regions=False, coalesce_window=COALESCE_WINDOW, remove_tags=None,
+                 replace=False):
+        super(Planner, self).__init__(True, False, role=role, region=region, concurrency=concurrency,
+                                      only_changed=only_changed, propagate=propagate, input_format=input_format,
+                                      parallel_regions=parallel_regions, coalesce_window=coalesce_window,
+                                      remove_tags=remove_tags, replace=replace)
+        # roles are assumed when the plan is executed, not while it is made
+        self.role_map = role_map or {}
+
+    def plan_file(self, filename):
+        return self.plan(self._rows(filename))
+
+    def plan_resources(self, resource_ids, tags):
+        tags = intern_tags(tags)
+        return self.plan(Row(number, resource_id, None, tags, ResourceRef.parse(resource_id))
+                         for (number, resource_id) in enumerate(resource_ids))
+
+    def plan_selection(self, selection, tags):
+        # listing the matching resources is the one thing planning asks AWS
+        selector = ResourceSelector(selection, role=self.role, region=self.region)
+        tags = intern_tags(tags)
+        return self.plan(bounded(Row(number, resource_id, None, tags, ResourceRef.parse(resource_id))
+                                 for (number, resource_id) in enumerate(selector.resources())))
+
+    def plan(self, rows):
+        counted = collections.Counter()
+
+        def count(rows):
+            for row in rows:
+                counted['rows'] += 1
+                yield row
+
+        rows = count(rows)
+        if self.coalescer is not None:
+            rows = self.coalescer.coalesce(rows)
+        if self.remove_tags:
+            rows = self._with_removals(rows)
+
+        groups = collections.OrderedDict()
+        for row in rows:
+            # an empty tag set is nothing to do, unless it is to replace whatever the resource has
+            if not row.tags and not self.replace:
+                continue
+            role, region = self._tagger_key(row.ref, row.region)
+            service, _ = route(row.ref)
+            key = (row.ref.account, role, region, service, tag_set_key(row.tags))
+            group = groups.get(key)
+            if group is None:
+                group = {'account': row.ref.account, 'role': role, 'region': region, 'service': service,
+                         'tags': dict(row.tags), 'supported': service in TAGGER_CLASSES, 'resources': []}
+                groups[key] = group
+            group['resources'].append(row.resource_id)
+
+        calls = self._calls(groups.values())
+        limits = self._rate_limits(calls)
+        regions = collections.OrderedDict()
+        for limit in limits:
+            regions[limit['region']] = regions.get(limit['region'], 0.0) + limit['estimated_seconds']
+        # with parallel regions the run takes as long as its slowest region, otherwise as long as all of them
+        seconds = max(regions.values(), default=0.0) if self.parallel_regions else sum(regions.values())
+
+        not_planned = []
+        if self.only_changed or self.replace:
+            not_planned.append('resources whose tags are already right, which are not written')
+        elif self.remove_tags:
+            not_planned.append('removals of keys a resource does not have, which are not sent')
+        for propagation in self.propagate:
+            if propagation != 'volumes':
+                not_planned.append('{0} found by --propagate, which are tagged as well'.format(propagation))
+
+        return {
+            'version': PLAN_VERSION,
+            'options': {
+                'role': self.role,
+                'region': self.region,
+                'role_map': self.role_map,
+                'propagate': self.propagate,
+                'only_changed': self.only_changed,
+                'replace': self.replace,
+            },
+            'summary': {
+                'rows': counted['rows'],
+                'resources': sum(len(group['resources']) for group in groups.values()),
+                'groups': len(groups),
+                'unsupported': sum(len(group['resources']) for group in groups.values() if not group['supported']),
+                'calls': sum(call['calls'] for call in calls),
+                'estimated_seconds': round(seconds, 1),
+                'not_planned': not_planned,
+            },
+            'calls': calls,
+            'rate_limits': limits,
+            'groups': list(groups.values()),
+        }
+
+    def _calls(self, groups):
+        # (role, region, client, operation, batch size, what a batch has in common) -> resources. Taggers are
+        # per role and region and queue resources by the tags written or the keys removed, so those share calls
+        # whatever group they are in, up to the next flush.
+        batched = collections.OrderedDict()
+
+        def add(group, client_name, operation, size, count, batch_key=None):
+            key = (group['role'], group['region'], client_name, operation, size, batch_key)
+            batched[key] = batched.get(key, 0) + count
+
+        def add_flushed(group, client_name, operation, size, batch_key):
+            # batched writes are flushed every FLUSH_INTERVAL rows, counted in the order the plan is executed
+            for (window, count) in windows:
+                add(group, client_name, operation, size, count, (window, batch_key))
+
+        reads = self.only_changed or self.replace
+        instances_looked_up = {}
+        offset = 0
+        for group in groups:
+            count = len(group['resources'])
+            windows = _windows(offset, count)
+            offset += count
+            if not group['supported']:
+                continue
+            values, removals = split_removals(group['tags'])
+            # the resources a key is removed from are read first, so it is only removed where it is set
+            group_reads = reads or bool(removals)
+            service = group['service']
+            if service == 'ec2':
+                if 'volumes' in self.propagate:
+                    instances = sum(1 for resource_id in group['resources'] if resource_id.startswith('i-'))
+                    # instances are looked up FILTER_SIZE at a time until a region's scan takes over, which
+                    # lists at least as many instances as are left
+                    looked_up = instances_looked_up.get((group['role'], group['region']), 0)
+                    filtered = max(min(instances, FULL_SCAN_THRESHOLD - looked_up), 0)
+                    if filtered:
+                        add(group, 'ec2', 'DescribeInstances', FILTER_SIZE, filtered)
+                    if instances > filtered:
+                        add(group, 'ec2', 'DescribeInstances', INSTANCES_PAGE_SIZE, instances - filtered)
+                    instances_looked_up[(group['role'], group['region'])] = looked_up + instances
+                if group_reads:
+                    add(group, 'ec2', 'DescribeTags', min(DIFF_WINDOW, INSTANCE_FILTER_SIZE), count)
+                if values:
+                    add_flushed(group, 'ec2', 'CreateTags', MAX_CREATE_TAGS_RESOURCES, tag_set_key(values))
+                if removals:
+                    add_flushed(group, 'ec2', 'DeleteTags', MAX_CREATE_TAGS_RESOURCES, tuple(removals))
+                continue
+
+            if service == 's3':
+                # each bucket is located, read once, whether to diff or to merge, and then written whole, or has
+                # its tag set deleted
+                add(group, 's3', 'GetBucketLocation', 1, count)
+                add(group, 's3', 'GetBucketTagging', 1, count)
+                add(group, 's3', 'PutBucketTagging', 1, count)
+                continue
+
+            if group_reads:
+                add(group, 'resourcegroupstaggingapi', 'GetResources', min(DIFF_WINDOW, MAX_GET_RESOURCES_ARNS), count)
+            if ResourceGroupsTagger.supports(group['resources'][0], group['tags']):
+                if values:
+                    add_flushed(group, 'resourcegroupstaggingapi', 'TagResources', MAX_TAG_RESOURCES_ARNS,
+                                tag_set_key(values))
+                if removals:
+                    add_flushed(group, 'resourcegroupstaggingapi', 'UntagResources', MAX_TAG_RESOURCES_ARNS,
+                                tuple(removals))
+                continue
+
+            client_name, tag_operation, untag_operation = SERVICE_OPERATIONS[service]
+            if values:
+                add(group, client_name, tag_operation, 1, count)
+            if removals:
+                add(group, client_name, untag_operation, 1, count)
+
+        for role in sorted(set(self.role_map.values())):
+            add({'role': role, 'region': None}, 'sts', 'AssumeRole', 1, 1)
+
+        totals = collections.OrderedDict()
+        for ((role, region, client_name, operation, size, _), count) in batched.items():
+            total = totals.get((role, region, client_name, operation))
+            if total is None:
+                total = {'role': role, 'region': region, 'service': client_name, 'operation': operation,
+                         'calls': 0, 'resources': 0, 'batch_size': size}
+                totals[(role, region, client_name, operation)] = total
+            total['calls'] += _batches(count, size)
+            total['resources'] += count
+
+        return list(totals.values())
+
+    def _rate_limits(self, calls):
+        # calls share a token bucket per role, service and region, unless their operation has one of its own
+        buckets = collections.OrderedDict()
+        for call in calls:
+            region = None if call['service'] in GLOBAL_SERVICES else call['region']
+            operation = call['operation'] if (call['service'], call['operation']) in OPERATION_RATE_LIMITS else None
+            key = (call['role'], call['service'], region, operation)
+            bucket = buckets.get(key)
+            if bucket is None:
+                if operation:
+                    rate, capacity = OPERATION_RATE_LIMITS[(call['service'], operation)]
+                else:
+                    rate, capacity = RATE_LIMITS.get(call['service'], DEFAULT_RATE_LIMIT)
+                bucket = {'role': call['role'], 'region': region, 'service': call['service'],
+                          'operation': operation, 'rate': rate, 'burst': capacity, 'calls': 0}
+                buckets[key] = bucket
+            bucket['calls'] += call['calls']
+
+        for bucket in buckets.values():
+            # the burst goes out at once, the rest at the bucket's rate, unless the calls themselves take longer
+            waiting = max(0, bucket['calls'] - bucket['burst']) / bucket['rate']
+            working = bucket['calls'] * CALL_LATENCY / self.concurrency
+            bucket['estimated_seconds'] = round(max(waiting, working), 1)
+
+        return list(buckets.values())
+
+
+class PlanResourceTagger(CSVResourceTagger):
+    """Tags what a plan made by Planner lists, as it stands: each group's resources get the group's tags,
+    under the role, region and options the plan was made with. Rows are numbered in plan order, so a
+    checkpoint can resume a plan like a CSV file."""
+
+    def __init__(self, dryrun, verbose, plan, concurrency=1, tag_cache=None, checkpoint=None,
+                 parallel_regions=False):
+        options = plan['options']
+        # the plan's rows have already been merged and had their removals added
+        super(PlanResourceTagger, self).__init__(dryrun, verbose, role=options['role'], region=options['region'],
+                                                 concurrency=concurrency, only_changed=options['only_changed'],
+                                                 tag_cache=tag_cache, checkpoint=checkpoint,
+                                                 role_map=options['role_map'], propagate=options['propagate'],
+                                                 parallel_regions=parallel_regions, coalesce_window=0,
+                                                 replace=options['replace'])
+        self.plan = plan
+
+    def tag(self):
+        self._tag_rows(bounded(self._plan_rows()))
+
+    def _plan_rows(self):
+        skip = self.checkpoint.completed if self.checkpoint is not None else ()
+        number = 0
+        for group in self.plan['groups']:
+            tags = intern_tags(group['tags'])
+            for resource_id in group['resources']:
+                if number not in skip:
+                    yield Row(number, resource_id, group['region'], tags, ResourceRef.parse(resource_id))
+                number += 1
+
+
+def load_plan(filename):
+    """Reads a plan written by write_plan, raising ValueError when it is not one this version can execute."""
+    with open(filename) as plan_input:
+        try:
+            plan = json.load(plan_input)
+        except ValueError:
+            raise ValueError("{0} is not a plan: it is not valid JSON".format(filename))
+    if not isinstance(plan, dict) or plan.get('version') != PLAN_VERSION:
+        raise ValueError("{0} is not a version {1} plan".format(filename, PLAN_VERSION))
+    return plan
+
+
+def write_plan(plan, filename):
+    """Writes the plan as JSON to filename, or to stdout when filename is -, and summarizes it otherwise."""
+    if filename == '-':
+        json.dump(plan, sys.stdout, indent=2)
+        sys.stdout.write('\n')
+        return
+
+    with open(filename, 'w') as plan_output:
+        json.dump(plan, plan_output, indent=2)
+        plan_output.write('\n')
+
+    summary = plan['summary']
+    print("{0:<26} {1:<24} {2:<15} {3:>7} {4:>9} {5:>6}".format(
+        'service', 'operation', 'region', 'calls', 'resources', 'batch'))
+    for call in plan['calls']:
+        print("{0:<26} {1:<24} {2:<15} {3:>7} {4:>9} {5:>6}".format(
+            call['service'], call['operation'], call['region'] or '-', call['calls'], call['resources'],
+            call['batch_size']))
+    print("Planned {0} resources from {1} rows in {2} groups: {3} calls, about {4}s".format(
+        summary['resources'], summary['rows'], summary['groups'], summary['calls'], summary['estimated_seconds']))
+    if summary['unsupported']:
+        print("{0} resources are of a type that cannot be tagged".format(summary['unsupported']))
+    for item in summary['not_planned']:
+        print("Not counted: {0}".format(item))
+
+
+def _batches(count, size):
+    return int(math.ceil(count / float(size)))
+
+
+def _windows(offset, count):
+    # (flush window, rows) for count rows starting at row offset
+    windows = []
+    while count > 0:
+        window = offset // FLUSH_INTERVAL
+        rows = min(count, (window + 1) * FLUSH_INTERVAL - offset)
+        windows.append((window, rows))
+        offset += rows
+        count -= rows
+    return windows
@@ -0,0 +1,289 @@
+import threading
+
+import botocore
+
+from tagger.base_tagger import adaptive_retry, client
+from tagger.readers import Row
+from tagger.utils import ResourceRef, chunks
+
+# dependents that can be given the tags of the resources they belong to
+PROPAGATIONS = ['volumes', 'network-interfaces', 'snapshots', 'target-groups', 'rds-snapshots', 'log-groups']
+
+# rows whose dependents are looked up together
+PROPAGATION_WINDOW = 500
+
+# values per describe filter
+FILTER_SIZE = 200
+
+# past this many instances looked up in a region, the rest of its instances are listed in a paginated scan,
+# which takes fewer calls than looking them up FILTER_SIZE at a time
+FULL_SCAN_THRESHOLD = 5000
+
+# instances per page of describe_instances
+INSTANCES_PAGE_SIZE = 1000
+
+
+def propagated_rows(rows, lookup_index, window=PROPAGATION_WINDOW):
+    """Follows each Row with a Row for every dependent of its resource, carrying the same tags. Dependents
+    are looked up a window of rows at a time. Their rows have no number, so a checkpoint only records the
+    rows that were read from the input."""
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= window:
+            for propagated in _propagate_batch(batch, lookup_index):
+                yield propagated
+            batch = []
+
+    for propagated in _propagate_batch(batch, lookup_index):
+        yield propagated
+
+
+def _propagate_batch(batch, lookup_index):
+    by_index = {}
+    row_indexes = []
+    for row in batch:
+        index = lookup_index(row.ref, row.region)
+        row_indexes.append(index)
+        by_index.setdefault(id(index), (index, {}))[1][row.resource_id] = row.ref
+
+    dependents = {}
+    for (index, refs) in by_index.values():
+        dependents[id(index)] = index.dependents(list(refs.values()))
+
+    for (row, index) in zip(batch, row_indexes):
+        yield row
+        for ref in dependents[id(index)].get(row.resource_id, ()):
+            yield Row(None, ref.resource_id, index.region, row.tags, ref)
+
+
+def _pages(describe, request_token, response_token, **kwargs):
+    while True:
+        response = describe(**kwargs)
+        yield response
+        token = response.get(response_token)
+        if not token:
+            return
+        kwargs[request_token] = token
+
+
+class PropagationIndex(object):
+    """Relationships between the resources of one role and region, discovered with paginated bulk
+    describes and kept for the rest of the run. Instances, volumes and RDS databases are looked up only for
+    the resources being tagged, until FULL_SCAN_THRESHOLD instances have been, when every instance in the
+    region is listed instead; target groups and Lambda log groups are listed once for the whole region."""
+
+    def __init__(self, role, region, propagations):
+        self.role = role
+        self.region = region
+        self.propagations = set(propagations)
+        # instance ID -> (volume IDs, network interface IDs)
+        self.instances = {}
+        self.instances_looked_up = 0
+        self.instances_complete = False
+        self.snapshots = {}
+        self.db_snapshots = {}
+        self.target_groups = None
+        self.log_groups = None
+        self.lock = threading.Lock()
+        self.clients = {}
+
+    def dependents(self, refs):
+        """Returns the ResourceRefs of the dependents of each resource, keyed by resource ID."""
+        with self.lock:
+            found = {}
+            for (kind, lookup) in [('instance', self._instance_dependents), ('volume', self._volume_dependents),
+                                   ('loadbalancer', self._load_balancer_dependents),
+                                   ('db', self._db_dependents), ('function', self._function_dependents)]:
+                matching = [ref for ref in refs if _kind(ref) == kind]
+                if not matching:
+                    continue
+                try:
+                    for (resource_id, dependents) in lookup(matching).items():
+                        found.setdefault(resource_id, []).extend(dependents)
+                except botocore.exceptions.ClientError as e:
+                    print("Failed to look up the dependents of {0} resources: {1}".format(len(matching), e))
+
+        return found
+
+    def _instance_dependents(self, refs):
+        if not self.propagations & {'volumes', 'network-interfaces', 'snapshots'}:
+            return {}
+
+        self._load_instances([ref.id for ref in refs])
+        found = {}
+        volumes = []
+        for ref in refs:
+            volume_ids, interface_ids = self.instances.get(ref.id, ((), ()))
+            dependents = []
+            if 'volumes' in self.propagations:
+                dependents.extend(_ec2_ref(ref, 'volume', volume_id) for volume_id in volume_ids)
+            if 'network-interfaces' in self.propagations:
+                dependents.extend(_ec2_ref(ref, 'network-interface', interface_id) for interface_id in interface_ids)
+            found[ref.resource_id] = dependents
+            volumes.extend((ref, volume_id) for volume_id in volume_ids)
+
+        if 'snapshots' in self.propagations and volumes:
+            self._load_snapshots([volume_id for (_, volume_id) in volumes])
+            for (ref, volume_id) in volumes:
+                found[ref.resource_id].extend(_ec2_ref(ref, 'snapshot', snapshot_id)
+                                              for snapshot_id in self.snapshots.get(volume_id, ()))
+        return found
+
+    def _volume_dependents(self, refs):
+        if 'snapshots' not in self.propagations:
+            return {}
+
+        self._load_snapshots([ref.id for ref in refs])
+        return {ref.resource_id: [_ec2_ref(ref, 'snapshot', snapshot_id)
+                                  for snapshot_id in self.snapshots.get(ref.id, ())]
+                for ref in refs}
+
+    def _load_balancer_dependents(self, refs):
+        if 'target-groups' not in self.propagations:
+            return {}
+
+        if self.target_groups is None:
+            target_groups = {}
+            for response in _pages(self._elbv2_describe_target_groups, 'Marker', 'NextMarker', PageSize=400):
+                for target_group in response.get('TargetGroups', []):
+                    for load_balancer_arn in target_group.get('LoadBalancerArns', []):
+                        target_groups.setdefault(load_balancer_arn, []).append(target_group['TargetGroupArn'])
+            self.target_groups = target_groups
+
+        return {ref.resource_id: [ResourceRef.parse(arn) for arn in self.target_groups.get(ref.resource_id, ())]
+                for ref in refs}
+
+    def _db_dependents(self, refs):
+        if 'rds-snapshots' not in self.propagations:
+            return {}
+
+        lookups = [('db', 'db-instance-id', self._rds_describe_db_snapshots, 'DBSnapshots', 'DBInstanceIdentifier',
+                    'DBSnapshotArn'),
+                   ('cluster', 'db-cluster-id', self._rds_describe_db_cluster_snapshots, 'DBClusterSnapshots',
+                    'DBClusterIdentifier', 'DBClusterSnapshotArn')]
+        for (resource_type, filter_name, describe, result_key, identifier_key, arn_key) in lookups:
+            missing = sorted(set(ref.id for ref in refs if ref.resource_type == resource_type
+                                 and (resource_type, ref.id) not in self.db_snapshots))
+            for batch in chunks(missing, FILTER_SIZE):
+                for identifier in batch:
+                    self.db_snapshots[(resource_type, identifier)] = []
+                filters = [{'Name': filter_name, 'Values': batch}]
+                for response in _pages(describe, 'Marker', 'Marker', Filters=filters, MaxRecords=100):
+                    for snapshot in response.get(result_key, []):
+                        key = (resource_type, snapshot[identifier_key])
+                        self.db_snapshots.setdefault(key, []).append(snapshot[arn_key])
+
+        return {ref.resource_id: [ResourceRef.parse(arn)
+                                  for arn in self.db_snapshots.get((ref.resource_type, ref.id), ())]
+                for ref in refs}
+
+    def _function_dependents(self, refs):
+        if 'log-groups' not in self.propagations:
+            return {}
+
+        if self.log_groups is None:
+            self.log_groups = set()
+            for response in _pages(self._logs_describe_log_groups, 'nextToken', 'nextToken',
+                                   logGroupNamePrefix='/aws/lambda/'):
+                self.log_groups.update(log_group['logGroupName'] for log_group in response.get('logGroups', []))
+
+        found = {}
+        for ref in refs:
+            # a function ARN may name a version or alias after the function name
+            name = '/aws/lambda/' + ref.id.split(':', 1)[0]
+            if name in self.log_groups:
+                found[ref.resource_id] = [ResourceRef.parse('arn:%s:logs:%s:%s:log-group:%s' % (
+                    ref.partition, ref.region or self.region, ref.account, name))]
+        return found
+
+    def _load_instances(self, instance_ids):
+        if self.instances_complete:
+            return
+
+        missing = sorted(set(instance_id for instance_id in instance_ids if instance_id not in self.instances))
+        self.instances_looked_up += len(missing)
+        if self.instances_looked_up > FULL_SCAN_THRESHOLD:
+            self._index_instances()
+            self.instances_complete = True
+            return
+
+        for batch in chunks(missing, FILTER_SIZE):
+            for instance_id in batch:
+                self.instances[instance_id] = ((), ())
+            self._index_instances(Filters=[{'Name': 'instance-id', 'Values': batch}])
+
+    def _index_instances(self, **kwargs):
+        for response in _pages(self._ec2_describe_instances, 'NextToken', 'NextToken', MaxResults=INSTANCES_PAGE_SIZE,
+                               **kwargs):
+            for reservation in response.get('Reservations', []):
+                for instance in reservation.get('Instances', []):
+                    self.instances[instance['InstanceId']] = (
+                        tuple(mapping['Ebs']['VolumeId'] for mapping in instance.get('BlockDeviceMappings', [])
+                              if mapping.get('Ebs', {}).get('VolumeId')),
+                        tuple(interface['NetworkInterfaceId'] for interface in instance.get('NetworkInterfaces', [])))
+
+    def _load_snapshots(self, volume_ids):
+        missing = sorted(set(volume_id for volume_id in volume_ids if volume_id not in self.snapshots))
+        for batch in chunks(missing, FILTER_SIZE):
+            for volume_id in batch:
+                self.snapshots[volume_id] = []
+            filters = [{'Name': 'volume-id', 'Values': batch}]
+            for response in _pages(self._ec2_describe_snapshots, 'NextToken', 'NextToken', Filters=filters,
+                                   OwnerIds=['self'], MaxResults=1000):
+                for snapshot in response.get('Snapshots', []):
+                    self.snapshots.setdefault(snapshot['VolumeId'], []).append(snapshot['SnapshotId'])
+
+    def _client(self, name):
+        # clients are only created for the relationships that are followed
+        if name not in self.clients:
+            self.clients[name] = client(name, role=self.role, region=self.region)
+        return self.clients[name]
+
+    @adaptive_retry
+    def _ec2_describe_instances(self, **kwargs):
+        return self._client('ec2').describe_instances(**kwargs)
+
+    @adaptive_retry
+    def _ec2_describe_snapshots(self, **kwargs):
+        return self._client('ec2').describe_snapshots(**kwargs)
+
+    @adaptive_retry
+    def _elbv2_describe_target_groups(self, **kwargs):
+        return self._client('elbv2').describe_target_groups(**kwargs)
+
+    @adaptive_retry
+    def _rds_describe_db_snapshots(self, **kwargs):
+        return self._client('rds').describe_db_snapshots(**kwargs)
+
+    @adaptive_retry
+    def _rds_describe_db_cluster_snapshots(self, **kwargs):
+        return self._client('rds').describe_db_cluster_snapshots(**kwargs)
+
+    @adaptive_retry
+    def _logs_describe_log_groups(self, **kwargs):
+        return self._client('logs').describe_log_groups(**kwargs)
+
+
+def _kind(ref):
+    if ref.service is None or ref.service == 'ec2':
+        if ref.id.startswith('i-'):
+            return 'instance'
+        if ref.id.startswith('vol-'):
+            return 'volume'
+    elif ref.service == 'elasticloadbalancing' and ref.resource_type == 'loadbalancer' and '/' in ref.id:
+        # application and network load balancers; classic ones have no target groups
+        return 'loadbalancer'
+    elif ref.service == 'rds' and ref.resource_type in ('db', 'cluster'):
+        return 'db'
+    elif ref.service == 'lambda' and ref.resource_type == 'function':
+        return 'function'
+    return None
+
+
+def _ec2_ref(parent, resource_type, resource_id):
+    # dependents of an ARN keep its account, so that they are tagged with the same role
+    if parent.account:
+        return ResourceRef.parse('arn:%s:ec2:%s:%s:%s/%s' % (parent.partition, parent.region, parent.account,
+                                                             resource_type, resource_id))
+    return ResourceRef(resource_id)
@@ -0,0 +1,147 @@
+import collections
+import csv
+import io
+import json
+import operator
+import queue
+import sys
+import threading
+
+from .utils import ResourceRef, intern_sorted_tags, intern_tags
+
+# rows handed from the reader thread to the tagger at a time, and how many such chunks may be waiting
+CHUNK_SIZE = 500
+MAX_QUEUED_CHUNKS = 8
+
+# distinct combinations of tag values a CSV reader remembers the TagSet of before starting over
+TAG_SET_CACHE_SIZE = 4096
+
+INPUT_FORMATS = ['csv', 'jsonl']
+
+# number is the position of the row in the input, counting data rows from 0; ref is resource_id parsed once
+Row = collections.namedtuple('Row', ['number', 'resource_id', 'region', 'tags', 'ref'])
+
+
+def input_format_for(filename):
+    if filename.endswith('.jsonl') or filename.endswith('.ndjson'):
+        return 'jsonl'
+    return 'csv'
+
+
+def read_rows(filename, input_format=None, resource_id_column='Id', region_column='Region', skip=()):
+    """Lazily yields a Row for each row of a CSV or JSON Lines file, or of stdin when filename is '-'.
+    region is None when the row does not name one. Rows whose numbers are in skip are passed over without
+    parsing their tags."""
+    if input_format is None:
+        input_format = input_format_for(filename)
+    reader = _read_jsonl if input_format == 'jsonl' else _read_csv
+
+    if filename == '-':
+        for row in reader(_stdin(), resource_id_column, region_column, skip):
+            yield row
+        return
+
+    with open(filename, newline='') as input_file:
+        for row in reader(input_file, resource_id_column, region_column, skip):
+            yield row
+
+
+def _stdin():
+    if hasattr(sys.stdin, 'buffer'):
+        return io.TextIOWrapper(sys.stdin.buffer, newline='')
+    return sys.stdin
+
+
+def _read_csv(input_file, resource_id_column, region_column, skip):
+    reader = csv.reader(input_file)
+    header = next(reader, None)
+    if header is None:
+        return
+
+    # work out once which columns hold the ID, the region and the tags rather than on every row
+    id_index = header.index(resource_id_column)
+    region_index = header.index(region_column) if region_column in header else None
+    tag_columns = sorted((name, index) for (index, name) in enumerate(header)
+                         if name != resource_id_column and name != region_column)
+    tag_values = operator.itemgetter(*[index for (_, index) in tag_columns]) if tag_columns else None
+
+    # rows with the same tags share one TagSet, found from the row's tag values alone
+    tag_sets = {}
+    for (number, row) in enumerate(reader):
+        if not row or number in skip:
+            continue
+        values = tag_values(row) if tag_values is not None else ()
+        tags = tag_sets.get(values)
+        if tags is None:
+            tags = intern_sorted_tags(tuple([(name, row[index]) for (name, index) in tag_columns if row[index] != ""]))
+            if len(tag_sets) >= TAG_SET_CACHE_SIZE:
+                tag_sets.clear()
+            tag_sets[values] = tags
+
+        region = row[region_index] if region_index is not None else None
+        resource_id = row[id_index]
+        yield Row(number, resource_id, region or None, tags, ResourceRef.parse(resource_id))
+
+
+def _read_jsonl(input_file, resource_id_column, region_column, skip):
+    # each line is an object with the same layout as a CSV row, or with the tags nested under "Tags"
+    for (number, line) in enumerate(input_file):
+        line = line.strip()
+        if not line or number in skip:
+            continue
+        record = json.loads(line)
+        tags = record.pop('Tags', None)
+        resource_id = record.pop(resource_id_column)
+        region = record.pop(region_column, None)
+        if tags is None:
+            tags = record
+        tags = intern_tags((key, str(value)) for (key, value) in tags.items() if value is not None and value != "")
+        yield Row(number, resource_id, region or None, tags, ResourceRef.parse(resource_id))
+
+
+def bounded(rows, chunk_size=CHUNK_SIZE, max_queued_chunks=MAX_QUEUED_CHUNKS):
+    """Reads rows on a separate thread into a bounded queue. Reading blocks while the queue is full, so
+    memory stays constant however large the input, and parsing overlaps with tagging."""
+    chunks = queue.Queue(maxsize=max_queued_chunks)
+    done = object()
+    stop = threading.Event()
+
+    def produce():
+        chunk = []
+        try:
+            for row in rows:
+                chunk.append(row)
+                if len(chunk) >= chunk_size:
+                    if not put(chunk):
+                        return
+                    chunk = []
+            if chunk and not put(chunk):
+                return
+        except Exception as exception:
+            put(exception)
+        put(done)
+
+    def put(item):
+        # gives up once the consumer has gone away so the reader thread never blocks forever
+        while not stop.is_set():
+            try:
+                chunks.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    producer = threading.Thread(target=produce, name='aws-tagger-reader')
+    producer.daemon = True
+    producer.start()
+    try:
+        while True:
+            chunk = chunks.get()
+            if chunk is done:
+                break
+            if isinstance(chunk, Exception):
+                raise chunk
+            for row in chunk:
+                yield row
+    finally:
+        stop.set()
@@ -0,0 +1,135 @@
+import queue
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+from .concurrency import ThreadLocalOutput
+
+# rows that may wait for a region's worker before the reader waits for it
+REGION_QUEUE_SIZE = 1000
+
+# bytes of a region's output held in memory before it spills to a temporary file
+SPOOL_SIZE = 1024 * 1024
+
+_DONE = object()
+
+
+class RegionReport(object):
+    """What a region's worker printed, kept until the run ends. Takes the place of the list that
+    ThreadLocalOutput captures into, but spills to a temporary file so a large region costs no memory."""
+
+    def __init__(self):
+        self.spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE, mode='w+')
+
+    def append(self, text):
+        self.spool.write(text)
+
+    def replay(self, stream):
+        self.spool.seek(0)
+        shutil.copyfileobj(self.spool, stream)
+        self.spool.close()
+
+
+class RegionWorker(object):
+    """A thread tagging the rows of one role and region as they are put to it. A failure ends the region's
+    tagging, not the run: the worker keeps taking rows so the reader never waits on it, and the rows it did
+    not get to are left out of the checkpoint for a resumed run."""
+
+    def __init__(self, key, tag_rows, output):
+        self.key = key
+        self.tag_rows = tag_rows
+        self.output = output
+        self.rows = queue.Queue(REGION_QUEUE_SIZE)
+        self.report = RegionReport()
+        self.count = 0
+        self.seconds = 0.0
+        self.error = None
+        self.drained = False
+        self.thread = threading.Thread(target=self._run, name='region-%s' % (key[1] or 'default'))
+        self.thread.daemon = True
+        self.thread.start()
+
+    def put(self, row):
+        self.count += 1
+        self.rows.put(row)
+
+    def close(self):
+        self.rows.put(_DONE)
+
+    def join(self):
+        self.thread.join()
+
+    def summary(self):
+        role, region = self.key
+        name = region or 'default region'
+        if role:
+            name = '{0} as {1}'.format(name, role)
+        if self.error is not None:
+            return "Failed to tag {0}, {1} rows, after {2:.2f}s: {3}".format(name, self.count, self.seconds,
+                                                                             self.error)
+        return "Tagged {0}: {1} rows in {2:.2f}s".format(name, self.count, self.seconds)
+
+    def _queued_rows(self):
+        while True:
+            row = self.rows.get()
+            if row is _DONE:
+                self.drained = True
+                return
+            yield row
+
+    def _run(self):
+        self.output.local.buffer = self.report
+        started = time.time()
+        try:
+            self.tag_rows(self._queued_rows())
+        except Exception as e:
+            self.error = e
+            if not self.drained:
+                for _ in self._queued_rows():
+                    pass
+        finally:
+            self.seconds = time.time() - started
+            self.output.local.buffer = None
+
+
+class RegionalRunner(object):
+    """Splits a stream of rows by the role and region they are tagged in and tags each part on its own
+    RegionWorker, with its own taggers and clients, so total time approaches that of the largest region
+    rather than the sum of all of them. Output is held back and replayed region by region, in the order the
+    regions first appear in the input, followed by how each region fared.
+
+    region_key(row) returns a row's (role, region); tag_rows(key, output) returns a callable that tags an
+    iterable of that region's rows, printing to output."""
+
+    def __init__(self, region_key, tag_rows):
+        self.region_key = region_key
+        self.tag_rows = tag_rows
+
+    def run(self, rows):
+        output = ThreadLocalOutput(sys.stdout)
+        sys.stdout = output
+        workers = {}
+        try:
+            for row in rows:
+                key = self.region_key(row)
+                worker = workers.get(key)
+                if worker is None:
+                    worker = RegionWorker(key, self.tag_rows(key, output), output)
+                    workers[key] = worker
+                worker.put(row)
+        finally:
+            for worker in workers.values():
+                worker.close()
+            for worker in workers.values():
+                worker.join()
+            sys.stdout = output.stream
+
+            # dicts keep insertion order, which is the order the regions first appeared in
+            for worker in workers.values():
+                worker.report.replay(sys.stdout)
+            for worker in workers.values():
+                print(worker.summary())
+
+        return workers
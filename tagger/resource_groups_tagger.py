@@ -0,0 +1,122 @@
+import threading
+
+import botocore
+
+from tagger.base_tagger import adaptive_retry, format_dict, aws_tags_to_dict, split_removals, tag_set_key, client
+from tagger.utils import chunks
+
+# TagResources and UntagResources accept at most 20 ARNs and 50 tags per call, GetResources at most 100 ARNs
+MAX_TAG_RESOURCES_ARNS = 20
+MAX_TAG_RESOURCES_TAGS = 50
+MAX_GET_RESOURCES_ARNS = 100
+
+# services whose ARNs are tagged through the Resource Groups Tagging API. EC2 has its own batching, S3
+# is left out because TagResources replaces the whole bucket tag set and CloudFront is only served
+# from us-east-1.
+BULK_SERVICES = ['acm-pca', 'dynamodb', 'elasticache', 'elasticfilesystem', 'elasticloadbalancing', 'es',
+                 'kinesis', 'lambda', 'logs', 'rds']
+
+class ResourceGroupsTagger(object):
+    def __init__(self, dryrun, verbose, role=None, region=None):
+        self.dryrun = dryrun
+        self.verbose = verbose
+        self.batch = True
+        self.tagging = client('resourcegroupstaggingapi', role=role, region=region)
+        self.pending = {}
+        # tag keys -> (keys, ARNs) to remove them from at the next flush
+        self.removals = {}
+        self.pending_lock = threading.Lock()
+
+    @staticmethod
+    def supports(resource_arn, tags):
+        # tags may hold None values for the keys to remove, which go in an UntagResources call of their own
+        parts = resource_arn.split(':', 3)
+        values, removals = split_removals(tags)
+        return len(parts) > 2 and parts[2] in BULK_SERVICES and len(values) <= MAX_TAG_RESOURCES_TAGS and \
+            len(removals) <= MAX_TAG_RESOURCES_TAGS
+
+    def tag(self, resource_arn, tags):
+        key = tag_set_key(tags)
+        with self.pending_lock:
+            if key not in self.pending:
+                self.pending[key] = (key, [])
+            self.pending[key][1].append(resource_arn)
+
+    def untag(self, resource_arn, keys):
+        with self.pending_lock:
+            if tuple(keys) not in self.removals:
+                self.removals[tuple(keys)] = (list(keys), [])
+            self.removals[tuple(keys)][1].append(resource_arn)
+
+    def read_tags(self, resource_arns):
+        """Returns the current tags of each ARN the tagging API knows about."""
+        current = {}
+        for batch in chunks(sorted(set(resource_arns)), MAX_GET_RESOURCES_ARNS):
+            kwargs = {'ResourceARNList': batch}
+            while True:
+                response = self._tagging_get_resources(**kwargs)
+                for mapping in response.get('ResourceTagMappingList', []):
+                    current[mapping['ResourceARN']] = aws_tags_to_dict(mapping.get('Tags', []))
+
+                if not response.get('PaginationToken'):
+                    break
+                kwargs['PaginationToken'] = response['PaginationToken']
+
+        return current
+
+    def flush(self):
+        """Sends batched tags and removals, returning the ARNs tagged and (ARN, tags) pairs that need a
+        per-service retry. The tags of a retry hold None for the keys still to remove."""
+        with self.pending_lock:
+            pending = self.pending
+            removals = self.removals
+            self.pending = {}
+            self.removals = {}
+
+        tagged = []
+        # ARN -> the part of its tags that did not go through
+        failed = {}
+        for (tags, resource_arns) in pending.values():
+            aws_tags = {key: value for (key, value) in tags.items() if not key.startswith('aws:')}
+            self._send(self._tagging_tag_resources, resource_arns, {'Tags': aws_tags}, tags,
+                       ("tagging", " with " + format_dict(tags)), tagged, failed)
+        for (keys, resource_arns) in removals.values():
+            self._send(self._tagging_untag_resources, resource_arns, {'TagKeys': keys}, dict.fromkeys(keys),
+                       ("untagging", ": " + ", ".join(keys)), tagged, failed)
+
+        return [resource_arn for resource_arn in dict.fromkeys(tagged) if resource_arn not in failed], \
+            list(failed.items())
+
+    def _send(self, operation, resource_arns, kwargs, tags, description, tagged, failed):
+        for batch in chunks(resource_arns, MAX_TAG_RESOURCES_ARNS):
+            if self.verbose:
+                print("%s %s%s" % (description[0], ", ".join(batch), description[1]))
+            if self.dryrun:
+                tagged.extend(batch)
+                continue
+
+            try:
+                response = operation(ResourceARNList=batch, **kwargs)
+            except botocore.exceptions.ClientError:
+                for resource_arn in batch:
+                    failed.setdefault(resource_arn, {}).update(tags)
+                continue
+
+            failures = response.get('FailedResourcesMap', {})
+            for resource_arn in batch:
+                if resource_arn in failures:
+                    failed.setdefault(resource_arn, {}).update(tags)
+                else:
+                    tagged.append(resource_arn)
+
+    @adaptive_retry
+    def _tagging_get_resources(self, **kwargs):
+        return self.tagging.get_resources(**kwargs)
+
+    @adaptive_retry
+    def _tagging_tag_resources(self, **kwargs):
+        return self.tagging.tag_resources(**kwargs)
+
+    @adaptive_retry
+    def _tagging_untag_resources(self, **kwargs):
+        return self.tagging.untag_resources(**kwargs)
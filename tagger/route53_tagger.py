@@ -1,8 +1,9 @@
 import botocore
 
-from tagger.base_tagger import is_retryable_exception, format_dict, dict_to_aws_tags, client
-from retrying import retry
-from .utils import parse_arn
+from tagger.base_tagger import adaptive_retry, format_dict, dict_to_aws_tags, client
+from .utils import ResourceRef
+
+NOT_FOUND_ERRORS = ['ValidationException']
 
 class Route53Tagger(object):
     def __init__(self, dryrun, verbose, role=None, region=None):
@@ -16,15 +17,33 @@ class Route53Tagger(object):
             print("tagging %s with %s" % (resource_arn, format_dict(tags)))
         if not self.dryrun:
             try:
-                arn = parse_arn(resource_arn)
+                arn = ResourceRef.parse(resource_arn)
 
-                self._route53_add_tags(ResourceType=arn['resource_type'], ResourceId=arn['resource'], AddTags=aws_tags)
+                self._route53_add_tags(ResourceType=arn.resource_type, ResourceId=arn.id, AddTags=aws_tags)
             except botocore.exceptions.ClientError as exception:
-                if exception.response["Error"]["Code"] in ['ValidationException']:
+                if exception.response["Error"]["Code"] in NOT_FOUND_ERRORS:
                     print("Resource not found: %s" % resource_arn)
                 else:
                     raise exception
 
-    @retry(retry_on_exception=is_retryable_exception, stop_max_delay=30000, wait_exponential_multiplier=1000)
+    def untag(self, resource_arn, keys):
+        if self.verbose:
+            print("untagging %s: %s" % (resource_arn, ", ".join(keys)))
+        if not self.dryrun:
+            try:
+                arn = ResourceRef.parse(resource_arn)
+
+                self._route53_remove_tags(ResourceType=arn.resource_type, ResourceId=arn.id, RemoveTagKeys=keys)
+            except botocore.exceptions.ClientError as exception:
+                if exception.response["Error"]["Code"] in NOT_FOUND_ERRORS:
+                    print("Resource not found: %s" % resource_arn)
+                else:
+                    raise exception
+
+    @adaptive_retry
     def _route53_add_tags(self, **kwargs):
-        return self.route53.change_tags_for_resource(**kwargs)
\ No newline at end of file
+        return self.route53.change_tags_for_resource(**kwargs)
+
+    @adaptive_retry
+    def _route53_remove_tags(self, **kwargs):
+        return self.route53.change_tags_for_resource(**kwargs)
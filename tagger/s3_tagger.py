@@ -1,41 +1,183 @@
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
 import botocore
 
-from tagger.base_tagger import is_retryable_exception, format_dict, dict_to_aws_tags, aws_tags_to_dict, client
-from retrying import retry
+from tagger.base_tagger import adaptive_retry, format_dict, dict_to_aws_tags, aws_tags_to_dict, client
+from tagger.concurrency import ThreadLocalOutput, capture_output
+
+# GetBucketLocation leaves out us-east-1 and names eu-west-1 by its old name
+LOCATION_REGIONS = {None: 'us-east-1', '': 'us-east-1', 'EU': 'eu-west-1'}
+
+# bucket name -> region, or None for a bucket that could not be located. Shared by every role and region, since
+# bucket names are global
+_bucket_regions = {}
 
 class S3Tagger(object):
-    def __init__(self, dryrun, verbose, role=None, region=None):
+    def __init__(self, dryrun, verbose, role=None, region=None, tag_cache=None, batch=False, concurrency=1):
         self.dryrun = dryrun
         self.verbose = verbose
+        self.tag_cache = tag_cache
+        self.batch = batch
+        self.concurrency = concurrency
+        self.role = role
+        self.region = region
         self.s3 = client('s3', role=role, region=region)
+        # bucket -> the tags of every row for that bucket since the last flush, later rows winning
+        self.pending = {}
+        self.pending_lock = threading.Lock()
+        # bucket -> the tags read since the last flush, so that a bucket read to diff its tags is not read again
+        # to merge them. Each is used by one write at most.
+        self.read_ahead = {}
+
+    def read_tags(self, bucket_name):
+        read = self.read_ahead.get(bucket_name)
+        if read is not None:
+            return read
+
+        if self.tag_cache is not None:
+            cached = self.tag_cache.get(bucket_name)
+            if cached is not None:
+                return cached
 
-    def tag(self, bucket_name, tags):
         try:
-            response = self._s3_get_bucket_tagging(Bucket=bucket_name)
-            # add existing tags
-            for (key, value) in aws_tags_to_dict(response.get('TagSet', [])).items():
-                if key not in tags:
-                    tags[key] = value
+            response = self._s3_get_bucket_tagging(self._client(bucket_name), Bucket=bucket_name)
+            tags = aws_tags_to_dict(response.get('TagSet', []))
         except botocore.exceptions.ClientError as exception:
-            if exception.response["Error"]["Code"] not in ['NoSuchTagSet', 'NoSuchBucket']:
+            code = exception.response["Error"]["Code"]
+            if code not in ['NoSuchTagSet', 'NoSuchBucket']:
                 raise exception
+            tags = {}
+            if code == 'NoSuchBucket':
+                return tags
+
+        if self.tag_cache is not None:
+            self.tag_cache.put(bucket_name, tags)
+        self.read_ahead[bucket_name] = tags
+        return tags
+
+    def tag(self, bucket_name, tags):
+        if self.batch:
+            with self.pending_lock:
+                self.pending.setdefault(bucket_name, {}).update(tags)
+            return
+
+        self._tag(bucket_name, tags)
+
+    def untag(self, bucket_name, keys):
+        # the bucket's tag set is written whole, so removals are merged in with any tags queued for it
+        self.tag(bucket_name, dict.fromkeys(keys))
+
+    def flush(self):
+        """Writes each bucket queued since the last flush with one read and one write, returning the buckets
+        tagged and (bucket, exception) pairs for failures."""
+        with self.pending_lock:
+            pending = self.pending
+            self.pending = {}
+
+        errors = {}
+
+        def write(bucket_name, tags):
+            try:
+                self._tag(bucket_name, tags)
+            except botocore.exceptions.ClientError as exception:
+                errors[bucket_name] = exception
+
+        output = sys.stdout
+        if self.concurrency > 1 and len(pending) > 1 and isinstance(output, ThreadLocalOutput):
+            # each bucket is a read and a write of its own, so up to `concurrency` of them go out at once, with
+            # what they print replayed in order
+            with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+                for text in executor.map(lambda item: capture_output(output, write, *item), pending.items()):
+                    output.write(text)
+        else:
+            for (bucket_name, tags) in pending.items():
+                write(bucket_name, tags)
+
+        # the buckets read but not written had nothing to change, and are read again if they come up later
+        self.read_ahead = {}
+        tagged = [bucket_name for bucket_name in pending if bucket_name not in errors]
+        return tagged, list(errors.items())
+
+    def _tag(self, bucket_name, tags):
+        # existing tags are kept unless overwritten or removed, in a copy so the caller's tags are left alone
+        current = self.read_tags(bucket_name)
+        self.read_ahead.pop(bucket_name, None)
+        merged = dict(current)
+        merged.update(tags)
+        merged = {key: value for (key, value) in merged.items() if value is not None}
+        if merged == current:
+            return
 
-        aws_tags = dict_to_aws_tags(tags)
-        if self.verbose:
-            print("tagging %s with %s" % (bucket_name, format_dict(tags)))
+        aws_tags = dict_to_aws_tags(merged)
+        if self.verbose and aws_tags:
+            print("tagging %s with %s" % (bucket_name, format_dict(merged)))
+        elif self.verbose:
+            print("untagging %s: %s" % (bucket_name, ", ".join(sorted(current))))
         if not self.dryrun:
             try:
-                self._s3_put_bucket_tagging(Bucket=bucket_name, Tagging={'TagSet': aws_tags})
+                if aws_tags:
+                    self._s3_put_bucket_tagging(self._client(bucket_name), Bucket=bucket_name,
+                                                Tagging={'TagSet': aws_tags})
+                else:
+                    # a bucket cannot be given an empty tag set, only have its tag set deleted
+                    self._s3_delete_bucket_tagging(self._client(bucket_name), Bucket=bucket_name)
             except botocore.exceptions.ClientError as exception:
+                if self.tag_cache is not None:
+                    self.tag_cache.invalidate(bucket_name)
                 if exception.response["Error"]["Code"] in ['NoSuchBucket']:
                     print("Resource not found: %s" % bucket_name)
                 else:
                     raise exception
+            else:
+                # the put replaced the whole tag set, so the cache can hold what was written
+                if self.tag_cache is not None:
+                    self.tag_cache.put(bucket_name, aws_tags_to_dict(aws_tags))
+
+    def _client(self, bucket_name):
+        # calls go straight to the bucket's own region rather than being redirected there
+        if bucket_name in _bucket_regions:
+            region = _bucket_regions[bucket_name]
+        else:
+            region = self._locate(bucket_name)
+            _bucket_regions[bucket_name] = region
+        if region is None:
+            # the bucket could not be located, and is not looked up again
+            return self.s3
+        return client('s3', role=self.role, region=region)
+
+    def _locate(self, bucket_name):
+        try:
+            location = self._s3_get_bucket_location(Bucket=bucket_name).get('LocationConstraint')
+            return LOCATION_REGIONS.get(location, location)
+        except botocore.exceptions.ClientError as exception:
+            if exception.response["Error"]["Code"] == 'NoSuchBucket':
+                return None
+
+        # only the bucket owner may get its location, but HeadBucket names the region even when it is denied
+        try:
+            response = self._s3_head_bucket(Bucket=bucket_name)
+        except botocore.exceptions.ClientError as exception:
+            response = exception.response
+        return response.get('ResponseMetadata', {}).get('HTTPHeaders', {}).get('x-amz-bucket-region')
+
+    @adaptive_retry
+    def _s3_get_bucket_location(self, **kwargs):
+        return self.s3.get_bucket_location(**kwargs)
+
+    @adaptive_retry
+    def _s3_head_bucket(self, **kwargs):
+        return self.s3.head_bucket(**kwargs)
+
+    @adaptive_retry
+    def _s3_get_bucket_tagging(self, s3, **kwargs):
+        return s3.get_bucket_tagging(**kwargs)
 
-    @retry(retry_on_exception=is_retryable_exception, stop_max_delay=30000, wait_exponential_multiplier=1000)
-    def _s3_get_bucket_tagging(self, **kwargs):
-        return self.s3.get_bucket_tagging(**kwargs)
+    @adaptive_retry
+    def _s3_put_bucket_tagging(self, s3, **kwargs):
+        return s3.put_bucket_tagging(**kwargs)
 
-    @retry(retry_on_exception=is_retryable_exception, stop_max_delay=30000, wait_exponential_multiplier=1000)
-    def _s3_put_bucket_tagging(self, **kwargs):
-        return self.s3.put_bucket_tagging(**kwargs)
\ No newline at end of file
+    @adaptive_retry
+    def _s3_delete_bucket_tagging(self, s3, **kwargs):
+        return s3.delete_bucket_tagging(**kwargs)
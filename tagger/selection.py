@@ -0,0 +1,147 @@
+import fnmatch
+
+from tagger.base_tagger import adaptive_retry, aws_tags_to_dict, client
+from tagger.utils import ResourceRef
+
+# instance states whose tags are worth changing
+INSTANCE_STATES = ['pending', 'running', 'stopping', 'stopped']
+
+
+class Selection(object):
+    """Which resources to tag, parsed from --select terms. All terms must match:
+
+        tag:KEY=VALUE[,VALUE...]   the resource has tag KEY with one of the values
+        tag:KEY                    the resource has tag KEY
+        type=TYPE[,TYPE...]        resource types as the tagging API names them, e.g. ec2:instance, rds:db, s3
+        name=PATTERN               the Name tag, or the bucket name or resource ID, matches a shell-style pattern
+    """
+
+    def __init__(self, tag_filters=None, resource_types=None, name_pattern=None):
+        # tag key -> list of accepted values, or None when any value will do
+        self.tag_filters = tag_filters or {}
+        self.resource_types = resource_types or []
+        self.name_pattern = name_pattern
+
+    @classmethod
+    def parse(cls, terms):
+        selection = cls()
+        for term in terms:
+            field, _, value = term.partition('=')
+            if field.startswith('tag:') and len(field) > 4:
+                selection.tag_filters[field[4:]] = value.split(',') if value else None
+            elif field == 'type' and value:
+                selection.resource_types.extend(value.split(','))
+            elif field == 'name' and value:
+                selection.name_pattern = value
+            else:
+                raise ValueError("Invalid --select term %s" % term)
+        return selection
+
+    def matches_name(self, resource_id, tags):
+        if self.name_pattern is None:
+            return True
+        return any(fnmatch.fnmatchcase(name, self.name_pattern) for name in (tags.get('Name'), resource_id) if name)
+
+
+class ResourceSelector(object):
+    """Lists the resources matching a Selection with paginated bulk calls and yields their IDs as each page
+    arrives. Instances are listed with describe_instances, so instances that were never tagged are found
+    too, and buckets with list_buckets when no tag is asked for. Everything else comes from the tagging
+    API's GetResources, which only knows about resources that have or had tags."""
+
+    def __init__(self, selection, role=None, region=None):
+        self.selection = selection
+        self.role = role
+        self.region = region
+        self.clients = {}
+
+    def resources(self):
+        resource_types = list(self.selection.resource_types)
+        if 'ec2:instance' in resource_types:
+            resource_types.remove('ec2:instance')
+            for resource_id in self._instances():
+                yield resource_id
+
+        if 's3' in resource_types and not self.selection.tag_filters:
+            resource_types.remove('s3')
+            for resource_id in self._buckets():
+                yield resource_id
+
+        if resource_types or not self.selection.resource_types:
+            for resource_id in self._tagged_resources(resource_types):
+                yield resource_id
+
+    def _instances(self):
+        filters = [{'Name': 'instance-state-name', 'Values': INSTANCE_STATES}]
+        for (key, values) in sorted(self.selection.tag_filters.items()):
+            if values is None:
+                filters.append({'Name': 'tag-key', 'Values': [key]})
+            else:
+                filters.append({'Name': 'tag:%s' % key, 'Values': values})
+
+        kwargs = {'Filters': filters, 'MaxResults': 1000}
+        while True:
+            response = self._ec2_describe_instances(**kwargs)
+            for reservation in response.get('Reservations', []):
+                for instance in reservation.get('Instances', []):
+                    tags = aws_tags_to_dict(instance.get('Tags', []))
+                    if self.selection.matches_name(instance['InstanceId'], tags):
+                        yield instance['InstanceId']
+
+            if not response.get('NextToken'):
+                break
+            kwargs['NextToken'] = response['NextToken']
+
+    def _buckets(self):
+        kwargs = {}
+        while True:
+            response = self._s3_list_buckets(**kwargs)
+            for bucket in response.get('Buckets', []):
+                if self.selection.matches_name(bucket['Name'], {}):
+                    yield bucket['Name']
+
+            if not response.get('ContinuationToken'):
+                break
+            kwargs['ContinuationToken'] = response['ContinuationToken']
+
+    def _tagged_resources(self, resource_types):
+        tag_filters = []
+        for (key, values) in sorted(self.selection.tag_filters.items()):
+            tag_filter = {'Key': key}
+            if values is not None:
+                tag_filter['Values'] = values
+            tag_filters.append(tag_filter)
+
+        kwargs = {'ResourcesPerPage': 100}
+        if tag_filters:
+            kwargs['TagFilters'] = tag_filters
+        if resource_types:
+            kwargs['ResourceTypeFilters'] = resource_types
+        while True:
+            response = self._tagging_get_resources(**kwargs)
+            for mapping in response.get('ResourceTagMappingList', []):
+                resource_arn = mapping['ResourceARN']
+                resource_id = ResourceRef.parse(resource_arn).id
+                if self.selection.matches_name(resource_id, aws_tags_to_dict(mapping.get('Tags', []))):
+                    yield resource_arn
+
+            if not response.get('PaginationToken'):
+                break
+            kwargs['PaginationToken'] = response['PaginationToken']
+
+    def _client(self, name):
+        if name not in self.clients:
+            self.clients[name] = client(name, role=self.role, region=self.region)
+        return self.clients[name]
+
+    @adaptive_retry
+    def _ec2_describe_instances(self, **kwargs):
+        return self._client('ec2').describe_instances(**kwargs)
+
+    @adaptive_retry
+    def _s3_list_buckets(self, **kwargs):
+        return self._client('s3').list_buckets(**kwargs)
+
+    @adaptive_retry
+    def _tagging_get_resources(self, **kwargs):
+        return self._client('resourcegroupstaggingapi').get_resources(**kwargs)
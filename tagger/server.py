@@ -0,0 +1,315 @@
+import json
+import os
+import queue
+import socketserver
+import stat
+import threading
+import time
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from .coalesce import COALESCE_WINDOW, Coalescer
+from .readers import Row
+from .tagger import BaseResourceTagger
+from .utils import ResourceRef, intern_tags
+
+# seconds to wait after a request arrives for others to tag in the same batch
+BATCH_WINDOW = 0.05
+
+# resources past which a batch is tagged without waiting out the window
+MAX_BATCH = 5000
+
+# seconds before the relationships found by propagation are looked up again
+INDEX_TTL = 300
+
+# seconds a caller waits for its request to be tagged
+REQUEST_TIMEOUT = 300
+
+
+class BatchResults(object):
+    """Takes the place of a Checkpoint for one batch, collecting the numbers of the rows that were tagged."""
+
+    def __init__(self):
+        self.completed = set()
+        self.lock = threading.Lock()
+
+    def done(self, row_number):
+        with self.lock:
+            self.completed.add(row_number)
+
+    def sync(self):
+        pass
+
+
+class TagRequest(object):
+    def __init__(self, resources, tags, region=None):
+        self.resources = resources
+        self.tags = tags
+        self.region = region
+        self.future = Future()
+
+    @classmethod
+    def parse(cls, body):
+        """Builds a request from its JSON body, raising ValueError when it is malformed:
+
+            {"resources": ["i-0123456789abcdef0", "arn:aws:rds:..."], "tags": {"App": "web"}, "region": "us-east-1"}
+
+        A tag whose value is null is removed. region is optional and, as in a CSV file, only applies to
+        resources that are not ARNs."""
+        try:
+            body = json.loads(body)
+        except ValueError:
+            raise ValueError("The request is not valid JSON")
+        if not isinstance(body, dict):
+            raise ValueError("The request must be a JSON object")
+
+        resources = body.get('resources')
+        if not isinstance(resources, list) or not resources or \
+                not all(isinstance(resource, str) and resource for resource in resources):
+            raise ValueError('"resources" must be a list of resource IDs or ARNs')
+
+        tags = body.get('tags')
+        if not isinstance(tags, dict) or not tags or \
+                not all(value is None or isinstance(value, str) for value in tags.values()):
+            raise ValueError('"tags" must be an object of tag names and string values, or null to remove a tag')
+
+        region = body.get('region')
+        if region is not None and not isinstance(region, str):
+            raise ValueError('"region" must be a string')
+
+        return cls(resources, intern_tags(tags), region)
+
+
+class RequestBatch(object):
+    """The requests tagged in one batch. Rows for the same resource are merged, so a request that sets a tag
+    of a resource in the batch to a different value is held back for the next batch rather than merged away,
+    as is any later request for a resource of a held request. Each request's tags are then written in the
+    order the requests arrived. keys(request) returns the resource keys of a request's rows."""
+
+    def __init__(self, keys):
+        self.keys = keys
+        self.requests = []
+        self.held = []
+        self.size = 0
+        # resource key -> the tags the batch's requests set on it
+        self.tags = {}
+        self.held_keys = set()
+
+    def add(self, request):
+        keys = self.keys(request)
+        if self.held_keys.intersection(keys) or any(self._conflicts(key, request.tags) for key in keys):
+            self.held.append(request)
+            self.held_keys.update(keys)
+            return
+
+        for key in keys:
+            self.tags.setdefault(key, {}).update(request.tags)
+        self.requests.append(request)
+        self.size += len(request.resources)
+
+    def _conflicts(self, key, tags):
+        current = self.tags.get(key)
+        if current is None:
+            return False
+        return any(tag_key in current and current[tag_key] != value for (tag_key, value) in tags.items())
+
+
+class BatchingTagger(BaseResourceTagger):
+    """Tags requests as they arrive on a thread of its own. Requests that arrive within batch_window seconds
+    of the first one are tagged as one batch, so that their resources share bulk CreateTags and
+    TagResources calls. Taggers, clients, credentials and the indexes built by propagation are kept from one
+    batch to the next; the indexes are dropped every INDEX_TTL seconds so they pick up new attachments."""
+
+    def __init__(self, dryrun, verbose, role=None, region=None, concurrency=1, only_changed=False,
+                 tag_cache=None, role_map=None, propagate=None, remove_tags=None, replace=False,
+                 batch_window=BATCH_WINDOW, max_batch=MAX_BATCH):
+        super(BatchingTagger, self).__init__(dryrun, verbose, role=role, region=region, concurrency=concurrency,
+                                             only_changed=only_changed, tag_cache=tag_cache,
+                                             checkpoint=BatchResults(), role_map=role_map, propagate=propagate,
+                                             coalesce_window=COALESCE_WINDOW, remove_tags=remove_tags,
+                                             replace=replace)
+        self.batch_window = batch_window
+        self.max_batch = max_batch
+        self.requests = queue.Queue()
+        self.indexes_loaded = time.time()
+        self.thread = threading.Thread(target=self._run, name='batching-tagger')
+        self.thread.daemon = True
+
+    def start(self):
+        self.thread.start()
+
+    def submit(self, request):
+        self.requests.put(request)
+        return request.future
+
+    def stop(self):
+        """Tags the requests already submitted, then stops."""
+        self.requests.put(None)
+        self.thread.join()
+
+    def _run(self):
+        held = []
+        stopping = False
+        while held or not stopping:
+            # requests held back from the last batch go first, in the order they arrived
+            batch = RequestBatch(self._request_keys)
+            for request in held:
+                batch.add(request)
+            if not batch.requests:
+                request = self.requests.get()
+                if request is None:
+                    return
+                batch.add(request)
+
+            deadline = time.time() + self.batch_window
+            while not stopping and batch.size < self.max_batch:
+                try:
+                    request = self.requests.get(timeout=max(deadline - time.time(), 0))
+                except queue.Empty:
+                    break
+                if request is None:
+                    stopping = True
+                    break
+                batch.add(request)
+
+            self._tag_batch(batch.requests)
+            held = batch.held
+
+    def _request_keys(self, request):
+        return [self._resource_key(Row(None, resource_id, request.region, request.tags, ResourceRef.parse(resource_id)))
+                for resource_id in request.resources]
+
+    def _tag_batch(self, batch):
+        if time.time() - self.indexes_loaded > INDEX_TTL:
+            self.propagation_indexes = {}
+            self.indexes_loaded = time.time()
+
+        self.checkpoint = BatchResults()
+        # rows are numbered from 0 in every batch, so nothing merged in an earlier batch may carry over
+        self.coalescer = Coalescer(self._resource_key, window=self.coalescer.window, track_numbers=True)
+        rows = []
+        for request in batch:
+            for resource_id in request.resources:
+                rows.append(Row(len(rows), resource_id, request.region, request.tags, ResourceRef.parse(resource_id)))
+
+        try:
+            self._tag_stream(rows)
+        except Exception as e:
+            for request in batch:
+                request.future.set_exception(e)
+            return
+
+        # rows are numbered in request order, so each request's results are the next len(resources) numbers
+        number = 0
+        for request in batch:
+            results = []
+            for resource_id in request.resources:
+                status = 'tagged' if number in self.checkpoint.completed else 'failed'
+                results.append({'resource': resource_id, 'status': status})
+                number += 1
+            request.future.set_result(results)
+
+
+class TaggingServer(object):
+    """Serves tag requests to a BatchingTagger over HTTP on a local port, a Unix socket, or both.
+
+    Over HTTP a request is POSTed to / as JSON and answered with {"results": [{"resource": resource, "status":
+    "tagged" or "failed"}, ...]}, one result for each of its resources in order, or {"error": message}. Over
+    the Unix socket each request and each answer is one line of JSON; a connection may send any number of
+    requests. GET /health answers {"status": "ok"}."""
+
+    def __init__(self, tagger, verbose=False):
+        self.tagger = tagger
+        self.verbose = verbose
+        self.servers = []
+        self.stopped = threading.Event()
+
+    def handle(self, body):
+        """Tags the request in body and returns the HTTP status and the JSON-ready answer."""
+        try:
+            request = TagRequest.parse(body)
+        except ValueError as e:
+            return 400, {'error': str(e)}
+
+        try:
+            results = self.tagger.submit(request).result(timeout=REQUEST_TIMEOUT)
+        except Exception as e:
+            return 500, {'error': str(e)}
+        return 200, {'results': results}
+
+    def serve(self, socket_path=None, host='127.0.0.1', port=None):
+        """Serves until stop() is called, e.g. from a signal handler, or the process is interrupted."""
+        if socket_path:
+            # a socket left behind by a server that did not shut down cleanly
+            if os.path.exists(socket_path) and stat.S_ISSOCK(os.stat(socket_path).st_mode):
+                os.unlink(socket_path)
+            server = socketserver.ThreadingUnixStreamServer(socket_path, _SocketHandler)
+            os.chmod(socket_path, 0o600)
+            self._add(server)
+            print("Listening on {0}".format(socket_path))
+        if port is not None:
+            server = ThreadingHTTPServer((host, port), _HTTPHandler)
+            self._add(server)
+            print("Listening on http://{0}:{1}/".format(*server.server_address[:2]))
+
+        self.tagger.start()
+        try:
+            self.stopped.wait()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            for server in self.servers:
+                server.shutdown()
+                server.server_close()
+            self.tagger.stop()
+            if socket_path and os.path.exists(socket_path):
+                os.unlink(socket_path)
+
+    def stop(self):
+        self.stopped.set()
+
+    def _add(self, server):
+        server.daemon_threads = True
+        server.tagging = self
+        self.servers.append(server)
+        thread = threading.Thread(target=server.serve_forever, name='server-%d' % len(self.servers))
+        thread.daemon = True
+        thread.start()
+
+
+class _HTTPHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        if self.path not in ('/', '/tag'):
+            self._reply(404, {'error': 'Not found'})
+            return
+
+        length = int(self.headers.get('Content-Length') or 0)
+        self._reply(*self.server.tagging.handle(self.rfile.read(length)))
+
+    def do_GET(self):
+        if self.path == '/health':
+            self._reply(200, {'status': 'ok'})
+        else:
+            self._reply(404, {'error': 'Not found'})
+
+    def _reply(self, status, answer):
+        body = json.dumps(answer).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        if self.server.tagging.verbose:
+            BaseHTTPRequestHandler.log_message(self, format, *args)
+
+
+class _SocketHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            _, answer = self.server.tagging.handle(line)
+            self.wfile.write((json.dumps(answer) + '\n').encode('utf-8'))
+            self.wfile.flush()
@@ -0,0 +1,61 @@
+import json
+import sqlite3
+import threading
+import time
+
+DEFAULT_TTL = 3600
+
+
+class TagCache(object):
+    """Last known tags per resource, kept in a local SQLite file so that read-before-write taggers and
+    --only-changed can skip reads across runs. Entries expire after ttl seconds; a write to a resource
+    invalidates its entry unless the tagger knows the complete tag set it wrote."""
+
+    def __init__(self, path, ttl=DEFAULT_TTL):
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        with self.lock, self.connection:
+            self.connection.execute('CREATE TABLE IF NOT EXISTS tags '
+                                    '(resource TEXT PRIMARY KEY, tags TEXT NOT NULL, updated REAL NOT NULL)')
+
+    def get(self, resource):
+        return self.get_many([resource]).get(resource)
+
+    def get_many(self, resources):
+        """Returns the cached tags of those resources that have a fresh entry."""
+        resources = list(resources)
+        cached = {}
+        oldest = time.time() - self.ttl
+        with self.lock:
+            # stay under SQLite's default limit on bound parameters
+            for start in range(0, len(resources), 500):
+                batch = resources[start:start + 500]
+                rows = self.connection.execute(
+                    'SELECT resource, tags FROM tags WHERE updated >= ? AND resource IN (%s)'
+                    % ','.join('?' * len(batch)), [oldest] + batch)
+                for (resource, tags) in rows:
+                    cached[resource] = json.loads(tags)
+
+        return cached
+
+    def put(self, resource, tags):
+        self.put_many({resource: tags})
+
+    def put_many(self, tags_by_resource):
+        now = time.time()
+        with self.lock, self.connection:
+            self.connection.executemany(
+                'INSERT OR REPLACE INTO tags (resource, tags, updated) VALUES (?, ?, ?)',
+                [(resource, json.dumps(tags, sort_keys=True), now) for (resource, tags) in tags_by_resource.items()])
+
+    def invalidate(self, resource):
+        self.invalidate_many([resource])
+
+    def invalidate_many(self, resources):
+        with self.lock, self.connection:
+            self.connection.executemany('DELETE FROM tags WHERE resource = ?', [(resource,) for resource in resources])
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
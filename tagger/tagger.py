@@ -1,190 +1,554 @@
-import csv
+import copy
+import importlib
+import itertools
+import threading
 
 from botocore.exceptions import ClientError
-from .cloudfront_tagger import CloudfrontTagger
-from .cloudwatch_logs_tagger import CloudWatchLogsTagger
-from .dynamodb_tagger import DynamoDBTagger
-from .ec2_tagger import EC2Tagger
-from .efs_tagger import EFSTagger
-from .elasticache_tagger import ElasticacheTagger
-from .elasticsearch_tagger import ESTagger
-from .kinesis_tagger import KinesisTagger
-from .lambda_tagger import LambdaTagger
-from .loadbalancer_tagger import LBTagger
-from .rds_tagger import RDSTagger
-from .s3_tagger import S3Tagger
-from .acm_pca_tagger import ACMPCATagger
-from .route53_tagger import Route53Tagger
-from .utils import parse_arn
+from .resource_groups_tagger import ResourceGroupsTagger
+from .base_tagger import assume_roles, split_removals
+from .checkpoint import CHECKPOINT_INTERVAL
+from .coalesce import COALESCE_WINDOW, Coalescer
+from .concurrency import ConcurrentRunner
+from .diff import DiffStats, changed_rows
+from .propagation import PropagationIndex, propagated_rows
+from .readers import Row, bounded, read_rows
+from .regions import RegionalRunner
+from .selection import ResourceSelector
+from .utils import ResourceRef, intern_tags, resource_ref
+
+
+# the tagger class of each service, as module:class. A module is only imported once a resource of its
+# service is routed, so tagging a single resource loads one tagger rather than all of them.
+TAGGER_MODULES = {
+    'ec2': 'tagger.ec2_tagger:EC2Tagger',
+    'elasticfilesystem': 'tagger.efs_tagger:EFSTagger',
+    'rds': 'tagger.rds_tagger:RDSTagger',
+    'elasticloadbalancing': 'tagger.loadbalancer_tagger:LBTagger',
+    'elasticache': 'tagger.elasticache_tagger:ElasticacheTagger',
+    's3': 'tagger.s3_tagger:S3Tagger',
+    'es': 'tagger.elasticsearch_tagger:ESTagger',
+    'kinesis': 'tagger.kinesis_tagger:KinesisTagger',
+    'cloudfront': 'tagger.cloudfront_tagger:CloudfrontTagger',
+    'logs': 'tagger.cloudwatch_logs_tagger:CloudWatchLogsTagger',
+    'dynamodb': 'tagger.dynamodb_tagger:DynamoDBTagger',
+    'lambda': 'tagger.lambda_tagger:LambdaTagger',
+    'acm-pca': 'tagger.acm_pca_tagger:ACMPCATagger',
+    'route53': 'tagger.route53_tagger:Route53Tagger',
+}
+
+
+class TaggerRegistry(object):
+    """Looks up tagger classes by service name like a dict, importing each one on first use."""
+
+    def __init__(self, modules):
+        self.modules = modules
+        self.classes = {}
+
+    def __contains__(self, name):
+        return name in self.modules
+
+    def __iter__(self):
+        return iter(self.modules)
+
+    def __getitem__(self, name):
+        tagger_class = self.classes.get(name)
+        if tagger_class is None:
+            module_name, class_name = self.modules[name].split(':')
+            tagger_class = getattr(importlib.import_module(module_name), class_name)
+            self.classes[name] = tagger_class
+        return tagger_class
+
+
+TAGGER_CLASSES = TaggerRegistry(TAGGER_MODULES)
+
+# rows tagged between flushes of the batched tags, so that what the taggers hold queued stays bounded however
+# large the input; a checkpoint's journal is synced at the same points
+FLUSH_INTERVAL = CHECKPOINT_INTERVAL
+
+# bare IDs, and the IDs inside EC2 ARNs, that start with one of these prefixes are tagged through that service
+ID_PREFIXES = {
+    'i': 'ec2',
+    'vol': 'ec2',
+    'eni': 'ec2',
+    'nat': 'ec2',
+    'vpn': 'ec2',
+    'cgw': 'ec2',
+    'vgw': 'ec2',
+    'snap': 'ec2',
+}
+# anything else that is not an ARN is taken to be a bucket name
+DEFAULT_SERVICE = 's3'
+# services whose taggers take the resource's ID rather than its ARN
+TAGGED_BY_ID = ['ec2', 's3']
+
+
+def route(ref):
+    """Returns the name of the tagger for a ResourceRef and the ID or ARN to hand that tagger."""
+    name = None
+    # other services' resources have names, which may happen to look like EC2 IDs
+    separator = ref.id.find('-')
+    if separator > 0 and (not ref.is_arn or ref.service == 'ec2'):
+        name = ID_PREFIXES.get(ref.id[:separator])
+    if name is None:
+        name = ref.service or DEFAULT_SERVICE
+
+    if name in TAGGED_BY_ID:
+        return name, ref.id
+    return name, ref.resource_id
 
 
 class SingleResourceTagger(object):
-    def __init__(self, dryrun, verbose, role=None, region=None, tag_volumes=False):
+    def __init__(self, dryrun, verbose, role=None, region=None, batch=False, tag_cache=None, concurrency=1):
+        self.dryrun = dryrun
+        self.verbose = verbose
+        self.role = role
+        self.region = region
+        self.batch = batch
+        self.tag_cache = tag_cache
+        self.concurrency = concurrency
+        # service taggers, and their clients, are only built once a resource of that service shows up
         self.taggers = {}
-        self.taggers['ec2'] = EC2Tagger(dryrun, verbose, role=role, region=region, tag_volumes=tag_volumes)
-        self.taggers['elasticfilesystem'] = EFSTagger(dryrun, verbose, role=role, region=region)
-        self.taggers['rds'] = RDSTagger(dryrun, verbose, role=role, region=region)
-        self.taggers['elasticloadbalancing'] = LBTagger(dryrun, verbose, role=role, region=region)
-        self.taggers['elasticache'] = ElasticacheTagger(dryrun, verbose, role=role, region=region)
-        self.taggers['s3'] = S3Tagger(dryrun, verbose, role=role, region=region)
-        self.taggers['es'] = ESTagger(dryrun, verbose, role=role, region=region)
-        self.taggers['kinesis'] = KinesisTagger(dryrun, verbose, role=role, region=region)
-        self.taggers['cloudfront'] = CloudfrontTagger(dryrun, verbose, role=role, region=region)
-        self.taggers['logs'] = CloudWatchLogsTagger(dryrun, verbose, role=role, region=region)
-        self.taggers['dynamodb'] = DynamoDBTagger(dryrun, verbose, role=role, region=region)
-        self.taggers['lambda'] = LambdaTagger(dryrun, verbose, role=role, region=region)
-        self.taggers['acm-pca'] = ACMPCATagger(dryrun, verbose, role=role, region=region)
-        self.taggers['route53'] = Route53Tagger(dryrun, verbose, role=role, region=region)
-
-    def tag(self, resource_id, tags):
-        if resource_id == "":
+        self.taggers_lock = threading.Lock()
+        self.bulk_tagger = None
+
+    def tagger(self, name):
+        tagger = self.taggers.get(name)
+        if tagger is None and name in TAGGER_CLASSES:
+            with self.taggers_lock:
+                tagger = self.taggers.get(name)
+                if tagger is None:
+                    kwargs = {}
+                    if name == 'ec2':
+                        kwargs = {'batch': self.batch}
+                    elif name == 's3':
+                        kwargs = {'tag_cache': self.tag_cache, 'batch': self.batch, 'concurrency': self.concurrency}
+                    tagger = TAGGER_CLASSES[name](self.dryrun, self.verbose, role=self.role, region=self.region,
+                                                  **kwargs)
+                    self.taggers[name] = tagger
+
+        return tagger
+
+    def _bulk_tagger(self):
+        with self.taggers_lock:
+            if self.bulk_tagger is None:
+                self.bulk_tagger = ResourceGroupsTagger(self.dryrun, self.verbose, role=self.role,
+                                                        region=self.region)
+
+        return self.bulk_tagger
+
+    def tag(self, resource, tags):
+        # returns True when the tags were applied, False when they failed and None when there was nothing to do
+        # or the tags were queued for the next flush(). resource is an ID, an ARN or a ResourceRef. Tags whose
+        # value is None are removed from the resource.
+        ref = resource_ref(resource)
+        if ref.resource_id == "":
             return
 
         if len(tags) == 0:
             return
 
-        tagger = None
-        resource_arn = resource_id
-        if resource_id.startswith('arn:'):
-            product, resource_id = self._parse_arn(resource_id)
-            if product:
-                tagger = self.taggers.get(product)
-        else:
-            tagger = self.taggers['s3']
-
-        if resource_id.startswith('i-'):
-            tagger = self.taggers['ec2']
-            resource_arn = resource_id
-        elif resource_id.startswith('vol-'):
-            tagger = self.taggers['ec2']
-            resource_arn = resource_id
-        elif resource_id.startswith('nat-'):
-            tagger = self.taggers['ec2']
-            resource_arn = resource_id
-        elif resource_id.startswith('vpn-'):
-            tagger = self.taggers['ec2']
-            resource_arn = resource_id
-        elif resource_id.startswith('cgw-'):
-            tagger = self.taggers['ec2']
-            resource_arn = resource_id
-        elif resource_id.startswith('vgw-'):
-            tagger = self.taggers['ec2']
-            resource_arn = resource_id
-
-        elif resource_id.startswith('snap-'):
-            tagger = self.taggers['ec2']
-            resource_arn = resource_id
+        name, resource_arn = route(ref)
+        if name != 'ec2' and self.batch and ResourceGroupsTagger.supports(resource_arn, tags):
+            self._send(self._bulk_tagger(), resource_arn, tags)
+            return None
+
+        return self._apply(self.tagger(name), resource_arn, tags)
+
+    def resource_key(self, resource):
+        """The ID flush() reports back for a resource that was queued."""
+        _, resource_arn = route(resource_ref(resource))
+        return resource_arn
 
+    def lane(self, resource):
+        """The service, role and region whose API a resource is tagged through."""
+        name, _ = route(resource_ref(resource))
+        return name, self.role, self.region
+
+    def _apply(self, tagger, resource_arn, tags):
         try:
             if tagger:
-                tagger.tag(resource_arn, tags)
+                self._send(tagger, resource_arn, tags)
+                if getattr(tagger, 'batch', False):
+                    return None
+                if getattr(tagger, 'tag_cache', None) is None:
+                    self._invalidate([resource_arn])
             else:
-                print("Tagging is not support for this resource %s" % resource_id)
+                print("Tagging is not support for this resource %s" % resource_arn)
         except ClientError as e:
             print("Failed to apply tags to {0}: {1}".format(resource_arn, e))
             return False
 
         return True
 
-    def _parse_arn(self, resource_arn):
-        product = None
-        resource_id = None
-        parts = resource_arn.split(':')
-        if len(parts) > 5:
-            product = parts[2]
-            resource_id = parts[5]
-            resource_parts = resource_id.split('/')
-            if len(resource_parts) > 1:
-                resource_id = resource_parts[-1]
+    def _send(self, tagger, resource_arn, tags):
+        values, removals = split_removals(tags)
+        if values:
+            tagger.tag(resource_arn, values)
+        if removals:
+            tagger.untag(resource_arn, removals)
 
-        return product, resource_id
+    def flush(self):
+        """Sends any batched tags and returns the IDs that were tagged."""
+        tagged = []
+        if 'ec2' in self.taggers:
+            ec2_tagged, failed = self.taggers['ec2'].flush()
+            tagged.extend(ec2_tagged)
+            for (resource_id, exception) in failed:
+                print("Failed to apply tags to {0}: {1}".format(resource_id, exception))
 
+        # S3Tagger keeps the cache up to date itself, so its buckets are not invalidated
+        s3_tagged = []
+        if 's3' in self.taggers:
+            s3_tagged, failed = self.taggers['s3'].flush()
+            for (bucket_name, exception) in failed:
+                print("Failed to apply tags to {0}: {1}".format(bucket_name, exception))
 
-class MultipleResourceTagger(object):
-    def __init__(self, dryrun, verbose, role=None, region=None, tag_volumes=False):
-        self.dryrun = dryrun
-        self.verbose = verbose
-        self.tag_volumes = tag_volumes
-        self.role = role
-        self.region = region
-        self.regional_tagger = {}
+        if self.bulk_tagger is not None:
+            bulk_tagged, fallback = self.bulk_tagger.flush()
+            tagged.extend(bulk_tagged)
+            # anything the tagging API rejected goes through the service's own API, which reports the failure
+            for (resource_arn, tags) in fallback:
+                name, _ = route(ResourceRef.parse(resource_arn))
+                if self._apply(self.tagger(name), resource_arn, tags):
+                    tagged.append(resource_arn)
 
-    def tag(self, resource_ids, tags):
-        for resource_id in resource_ids:
-            if resource_id.startswith('arn:'):
-                arn = parse_arn(resource_id)
-                region = arn['region']
+        self._invalidate(tagged)
+        return tagged + s3_tagged
+
+    def _invalidate(self, resource_arns):
+        # the tags written and removed are merged into whatever the resource had, so the cached tag set is now stale
+        if self.tag_cache is not None and not self.dryrun:
+            self.tag_cache.invalidate_many(resource_arns)
+
+    def read_tags(self, resources):
+        """Reads the current tags of the resources (IDs or ResourceRefs) in bulk, keyed by resource ID.
+        Resources whose tags could not be read are left out."""
+        by_service = {}
+        for resource in resources:
+            ref = resource_ref(resource)
+            name, resource_arn = route(ref)
+            if name in TAGGER_CLASSES:
+                by_service.setdefault(name, []).append((ref.resource_id, resource_arn))
+
+        current = {}
+        for (name, resources) in by_service.items():
+            resource_arns = [resource_arn for (_, resource_arn) in resources]
+            try:
+                if name == 's3':
+                    # S3Tagger reads through the cache itself
+                    tags = {bucket: self.tagger('s3').read_tags(bucket) for bucket in resource_arns}
+                else:
+                    tags = self._read_tags(name, resource_arns)
+            except ClientError as e:
+                print("Failed to read tags of {0} resources: {1}".format(name, e))
+                continue
+
+            for (resource_id, resource_arn) in resources:
+                if resource_arn in tags:
+                    current[resource_id] = tags[resource_arn]
+
+        return current
+
+    def _read_tags(self, name, resource_arns):
+        tags = {}
+        if self.tag_cache is not None:
+            tags = self.tag_cache.get_many(resource_arns)
+            resource_arns = [resource_arn for resource_arn in resource_arns if resource_arn not in tags]
+            if not resource_arns:
+                return tags
+
+        if name == 'ec2':
+            read = self.tagger('ec2').read_tags(resource_arns)
+        else:
+            read = self._bulk_tagger().read_tags(resource_arns)
 
-            tagger = self.regional_tagger.get(region)
-            if tagger is None:
-                tagger = SingleResourceTagger(self.dryrun, self.verbose, role=self.role, region=region,
-                                              tag_volumes=self.tag_volumes)
-                self.regional_tagger[region] = tagger
+        if self.tag_cache is not None:
+            self.tag_cache.put_many(read)
+        tags.update(read)
+        return tags
 
-            tagger.tag(resource_id, tags)
 
+class BaseResourceTagger(object):
+    """Tags a stream of Rows, with one SingleResourceTagger per role and region. role_map maps account IDs
+    to the role to assume for ARNs in that account; other resources use role. propagate lists the kinds of
+    dependent resources, from propagation.PROPAGATIONS, that are given the tags of the resource they belong
+    to. With parallel_regions, the rows of each role and region are tagged on a worker of their own. Rows for
+    the same resource within coalesce_window resources of each other are merged into one write; a window of 0
+    writes every row. The tag keys in remove_tags are removed from every resource whose row does not set them.
+    With replace, each resource is left with exactly the tags of its row: its current tags are read and those
+    the row does not name are removed."""
 
-class CSVResourceTagger(object):
-    def __init__(self, dryrun, verbose, role=None, region=None, tag_volumes=False):
+    def __init__(self, dryrun, verbose, role=None, region=None, concurrency=1, only_changed=False, tag_cache=None,
+                 checkpoint=None, role_map=None, propagate=None, parallel_regions=False, coalesce_window=0,
+                 remove_tags=None, replace=False):
         self.dryrun = dryrun
         self.verbose = verbose
-        self.tag_volumes = tag_volumes
         self.role = role
         self.region = region
+        self.concurrency = concurrency
+        self.only_changed = only_changed
+        self.tag_cache = tag_cache
+        self.checkpoint = checkpoint
+        self.diff_stats = DiffStats()
+        self.role_map = role_map or {}
+        self.failed_roles = {}
+        if self.role_map:
+            self.failed_roles = assume_roles(self.role_map.values())
+            for (failed_role, exception) in self.failed_roles.items():
+                print("Failed to assume role {0}: {1}".format(failed_role, exception))
+        self.propagate = propagate or []
+        self.parallel_regions = parallel_regions
+        self.remove_tags = list(remove_tags or [])
+        self.replace = replace
+        self.coalescer = None
+        if coalesce_window > 0:
+            self.coalescer = Coalescer(self._resource_key, window=coalesce_window,
+                                       track_numbers=checkpoint is not None)
+        self.propagation_indexes = {}
         self.regional_tagger = {}
+        # row numbers waiting on a flush, keyed by the tagger and the ID the tagger reports back
+        self.queued_rows = {}
+        self.queued_rows_lock = threading.Lock()
+        # set on the copies tagging a single region, whose output is captured per region
+        self.output = None
+
+    def _tag_rows(self, rows):
+        if self.parallel_regions:
+            RegionalRunner(self._region_key, self._region_worker).run(rows)
+        else:
+            self._tag_stream(rows)
+
+        self._report()
+
+    def _region_key(self, row):
+        return self._tagger_key(row.ref, row.region)
+
+    def _region_worker(self, key, output):
+        # a copy of this tagger with its own taggers, indexes and queued rows, sharing the rest of the run's
+        # state: the checkpoint, tag cache, diff counts and failed roles are all safe to share between threads
+        worker = copy.copy(self)
+        worker.regional_tagger = {}
+        worker.propagation_indexes = {}
+        worker.queued_rows = {}
+        worker.queued_rows_lock = threading.Lock()
+        worker.output = output
+        return worker._tag_stream
+
+    def _tag_stream(self, rows):
+        with ConcurrentRunner(self.concurrency, output=self.output) as runner:
+            for window in self._windows(self._prepare(rows)):
+                for row in window:
+                    tagger = self._lookup_tagger(row.ref, row.region)
+                    runner.submit(tagger.lane(row.ref), self._apply_tags, tagger, row)
+
+                runner.drain()
+                for (key, tagger) in self.regional_tagger.items():
+                    runner.submit(('flush', key), self._flush, tagger)
+                runner.drain()
+                self._end_window()
+
+    def _prepare(self, rows):
+        if self.coalescer is not None:
+            rows = self.coalescer.coalesce(rows)
+        # after merging, so that a key set by any row for a resource is kept
+        if self.remove_tags:
+            rows = self._with_removals(rows)
+        if self.propagate:
+            rows = propagated_rows(rows, self._propagation_index)
+        if self.only_changed or self.replace:
+            # read the current tags first and only write resources whose tags differ
+            rows = changed_rows(rows, self._lookup_tagger, self.diff_stats, on_unchanged=self._completed,
+                                replace=self.replace)
+        else:
+            # a key is only removed from resources that have it, so removing it from the rest costs no calls
+            rows = changed_rows(rows, self._lookup_tagger, self.diff_stats, on_unchanged=self._completed,
+                                removals_only=True)
+        return rows
+
+    def _with_removals(self, rows):
+        # a None value removes the tag unless a row for the same resource sets it. Rows are looked at a flush
+        # window at a time, so that rows for one resource that were not merged still see each other. Rows with
+        # the same tags share a TagSet, so the result is usually worked out once per distinct set
+        with_removals = {}
+        rows = iter(rows)
+        while True:
+            window = list(itertools.islice(rows, FLUSH_INTERVAL))
+            if not window:
+                return
+
+            kept = {}
+            for row in window:
+                for key in self.remove_tags:
+                    if row.tags.get(key) is not None:
+                        kept.setdefault(self._resource_key(row), set()).add(key)
+
+            for row in window:
+                tags = intern_tags(row.tags)
+                keep = kept.get(self._resource_key(row)) if kept else None
+                if keep:
+                    merged = dict.fromkeys(key for key in self.remove_tags if key not in keep)
+                    merged.update(tags)
+                    yield row._replace(tags=intern_tags(merged))
+                    continue
+
+                merged = with_removals.get(tags)
+                if merged is None:
+                    merged = dict.fromkeys(self.remove_tags)
+                    merged.update(tags)
+                    merged = with_removals[tags] = intern_tags(merged)
+                yield row._replace(tags=merged)
+
+    def _windows(self, rows):
+        # batched tags are flushed, and any checkpoint synced, every FLUSH_INTERVAL rows
+        rows = iter(rows)
+        while True:
+            window = list(itertools.islice(rows, FLUSH_INTERVAL))
+            if not window:
+                return
+            yield window
+
+    def _end_window(self):
+        if self.checkpoint is not None:
+            self.checkpoint.sync()
+        # anything still queued failed to flush and is left for a resumed run
+        with self.queued_rows_lock:
+            self.queued_rows = {}
+
+    def _report(self):
+        if self.coalescer is not None and self.coalescer.merged_rows:
+            print(self.coalescer.summary())
+        if self.only_changed or self.replace:
+            print(self.diff_stats.summary())
+
+    def _apply_tags(self, tagger, row):
+        exception = self.failed_roles.get(tagger.role)
+        if exception is not None:
+            print("Failed to apply tags to {0}: {1}".format(row.resource_id, exception))
+            return False
+
+        result = tagger.tag(row.ref, row.tags)
+        if result:
+            self._completed(row)
+        elif result is None and self.checkpoint is not None and row.number is not None:
+            key = (id(tagger), tagger.resource_key(row.ref))
+            with self.queued_rows_lock:
+                self.queued_rows.setdefault(key, []).append(row.number)
+        return result
+
+    def _flush(self, tagger):
+        tagged = tagger.flush()
+        if self.checkpoint is not None:
+            with self.queued_rows_lock:
+                for resource_id in tagged:
+                    for number in self.queued_rows.pop((id(tagger), resource_id), []):
+                        self._journal(number)
+        return tagged
+
+    def _completed(self, row):
+        # rows added by propagation have no number and are not journaled
+        if self.checkpoint is not None and row.number is not None:
+            self._journal(row.number)
+
+    def _journal(self, number):
+        self.checkpoint.done(number)
+        # the rows merged into this one are done with it
+        if self.coalescer is not None:
+            for merged in self.coalescer.merged_into(number):
+                self.checkpoint.done(merged)
+
+    def _resource_key(self, row):
+        return self._tagger_key(row.ref, row.region), route(row.ref)[1]
+
+    def _tagger_key(self, ref, region):
+        if region is None:
+            region = ref.region
+
+        # buckets are tagged in their own region whatever the row says, so every bucket shares one tagger
+        if not region or route(ref)[0] == 's3':
+            region = self.region
+
+        role = self.role
+        if ref.account:
+            role = self.role_map.get(ref.account, role)
+
+        return role, region
+
+    def _lookup_tagger(self, ref, region):
+        role, region = self._tagger_key(ref, region)
+        tagger = self.regional_tagger.get((role, region))
+        if tagger is None:
+            tagger = SingleResourceTagger(self.dryrun, self.verbose, role=role, region=region, batch=True,
+                                          tag_cache=self.tag_cache, concurrency=self.concurrency)
+            self.regional_tagger[(role, region)] = tagger
+
+        return tagger
+
+    def _propagation_index(self, ref, region):
+        tagger = self._lookup_tagger(ref, region)
+        index = self.propagation_indexes.get((tagger.role, tagger.region))
+        if index is None:
+            index = PropagationIndex(tagger.role, tagger.region, self.propagate)
+            self.propagation_indexes[(tagger.role, tagger.region)] = index
+
+        return index
+
+
+class MultipleResourceTagger(BaseResourceTagger):
+    def tag(self, resource_ids, tags):
+        tags = intern_tags(tags)
+        self._tag_rows(Row(number, resource_id, None, tags, ResourceRef.parse(resource_id))
+                       for (number, resource_id) in enumerate(resource_ids))
+
+
+class CSVResourceTagger(BaseResourceTagger):
+    def __init__(self, dryrun, verbose, role=None, region=None, concurrency=1, only_changed=False, tag_cache=None,
+                 checkpoint=None, role_map=None, propagate=None, input_format=None, parallel_regions=False,
+                 coalesce_window=COALESCE_WINDOW, remove_tags=None, replace=False):
+        super(CSVResourceTagger, self).__init__(dryrun, verbose, role=role, region=region,
+                                                concurrency=concurrency, only_changed=only_changed,
+                                                tag_cache=tag_cache, checkpoint=checkpoint, role_map=role_map,
+                                                propagate=propagate, parallel_regions=parallel_regions,
+                                                coalesce_window=coalesce_window, remove_tags=remove_tags,
+                                                replace=replace)
+        self.input_format = input_format
         self.resource_id_column = 'Id'
         self.region_column = 'Region'
 
     def tag(self, filename):
-        with open(filename, 'rU') as csv_file:
-            reader = csv.reader(csv_file)
-            header_row = True
-            tag_index = None
-
-            for row in reader:
-                if header_row:
-                    header_row = False
-                    tag_index = self._parse_header(row)
-                else:
-                    self._tag_resource(tag_index, row)
+        self._tag_rows(self._rows(filename))
 
-    def _parse_header(self, header_row):
-        tag_index = {}
-        for index, name in enumerate(header_row):
-            tag_index[name] = index
+    def _rows(self, filename):
+        skip = self.checkpoint.completed if self.checkpoint is not None else ()
+        return bounded(read_rows(filename, self.input_format, resource_id_column=self.resource_id_column,
+                                 region_column=self.region_column, skip=skip))
 
-        return tag_index
+    def _apply_tags(self, tagger, row):
+        print("Applying tags to {0}".format(row.resource_id))
+        if super(CSVResourceTagger, self)._apply_tags(tagger, row):
+            print("Successfully applied tags to {0}".format(row.resource_id))
 
-    def _tag_resource(self, tag_index, row):
-        resource_id = row[tag_index[self.resource_id_column]]
-        tags = {}
-        for (key, index) in tag_index.items():
-            value = row[index]
-            if key != self.resource_id_column and key != self.region_column and value != "":
-                tags[key] = value
-
-        tagger = self._lookup_tagger(resource_id, tag_index, row)
-        print("Applying tags to {0}".format(resource_id))
-        if tagger.tag(resource_id, tags):
+    def _flush(self, tagger):
+        tagged = super(CSVResourceTagger, self)._flush(tagger)
+        for resource_id in tagged:
             print("Successfully applied tags to {0}".format(resource_id))
+        return tagged
 
-    def _lookup_tagger(self, resource_id, tag_index, row):
-        region = self.region
-        region_index = tag_index.get(self.region_column)
 
-        if region_index is not None:
-            region = row[region_index]
-        elif resource_id.startswith('arn:'):
-            arn = parse_arn(resource_id)
-            region = arn['region']
+class SelectResourceTagger(CSVResourceTagger):
+    """Tags every resource matching a selection.Selection, reporting each one as the CSV tagger does. The
+    resources are listed on the reader thread, so tagging starts with the first page of results."""
 
-        if region == '':
-            region = None
+    def __init__(self, dryrun, verbose, role=None, region=None, concurrency=1, only_changed=False, tag_cache=None,
+                 role_map=None, propagate=None, parallel_regions=False, remove_tags=None, replace=False):
+        # each resource is listed once, so no rows are held back waiting for another row to merge with
+        super(SelectResourceTagger, self).__init__(dryrun, verbose, role=role, region=region,
+                                                   concurrency=concurrency, only_changed=only_changed,
+                                                   tag_cache=tag_cache, role_map=role_map, propagate=propagate,
+                                                   parallel_regions=parallel_regions, coalesce_window=0,
+                                                   remove_tags=remove_tags, replace=replace)
 
-        tagger = self.regional_tagger.get(region)
-        if tagger is None:
-            tagger = SingleResourceTagger(self.dryrun, self.verbose, role=self.role, region=region,
-                                          tag_volumes=self.tag_volumes)
-            self.regional_tagger[region] = tagger
-
-        return tagger
+    def tag(self, selection, tags):
+        selector = ResourceSelector(selection, role=self.role, region=self.region)
+        tags = intern_tags(tags)
+        self._tag_rows(bounded(Row(number, resource_id, None, tags, ResourceRef.parse(resource_id))
+                               for (number, resource_id) in enumerate(selector.resources())))
@@ -0,0 +1,112 @@
+import threading
+import time
+
+# (requests per second, burst) per service. Operations with their own AWS throttling bucket are listed
+# separately so that, for example, EC2 describes do not eat into the CreateTags budget.
+DEFAULT_RATE_LIMIT = (10.0, 10)
+RATE_LIMITS = {
+    'ec2': (20.0, 100),
+    'resourcegroupstaggingapi': (5.0, 5),
+    'route53': (5.0, 5),
+    's3': (50.0, 50),
+    'sts': (50.0, 50),
+}
+OPERATION_RATE_LIMITS = {
+    ('ec2', 'CreateTags'): (5.0, 200),
+    ('s3', 'PutBucketTagging'): (10.0, 10),
+}
+
+# services with a single global endpoint share one limit regardless of the region they are called from
+GLOBAL_SERVICES = ['cloudfront', 'route53']
+
+# AIMD: a throttle cuts the send rate by DECREASE_FACTOR, at most once per DECREASE_COOLDOWN seconds so
+# that a burst of throttles from concurrent workers counts as one signal. Each success adds back about
+# one request per second for every second's worth of requests.
+DECREASE_FACTOR = 0.5
+DECREASE_COOLDOWN = 1.0
+MIN_RATE = 0.2
+
+
+class TokenBucket(object):
+    def __init__(self, rate, capacity):
+        self.rate = float(rate)
+        self.max_rate = float(rate)
+        self.capacity = float(capacity)
+        self.tokens = float(capacity)
+        self.updated = time.time()
+        self.decreased = 0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.time()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def throttled(self):
+        with self.lock:
+            now = time.time()
+            if now - self.decreased < DECREASE_COOLDOWN:
+                return
+            self.decreased = now
+            self.rate = max(MIN_RATE, self.rate * DECREASE_FACTOR)
+            # drop the burst allowance too, otherwise every waiting worker fires again at once
+            self.tokens = min(self.tokens, 0.0)
+
+    def succeeded(self):
+        if self.rate < self.max_rate:
+            with self.lock:
+                self.rate = min(self.max_rate, self.rate + 1.0 / self.rate)
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def rate_limiter(service, region, operation=None, role=None):
+    # AWS throttles each account separately, so calls made under different roles get their own buckets
+    if service in GLOBAL_SERVICES:
+        region = None
+    if (service, operation) not in OPERATION_RATE_LIMITS:
+        operation = None
+
+    key = (role, service, region, operation)
+    with _limiters_lock:
+        limiter = _limiters.get(key)
+        if limiter is None:
+            if operation:
+                rate, capacity = OPERATION_RATE_LIMITS[(service, operation)]
+            else:
+                rate, capacity = RATE_LIMITS.get(service, DEFAULT_RATE_LIMIT)
+            limiter = TokenBucket(rate, capacity)
+            _limiters[key] = limiter
+
+    return limiter
+
+
+_local = threading.local()
+
+
+def last_limiter():
+    """The token bucket the calling thread's last AWS call waited on."""
+    return getattr(_local, 'limiter', None)
+
+
+def attach_rate_limiter(aws_client, role=None):
+    """Makes every call made through the client wait for its service/region token bucket."""
+    service = aws_client.meta.service_model.service_name
+    region = aws_client.meta.region_name
+
+    def _acquire(model, **kwargs):
+        limiter = rate_limiter(service, region, model.name, role)
+        _local.limiter = limiter
+        limiter.acquire()
+
+    aws_client.meta.events.register('before-call', _acquire)
+    return aws_client
@@ -1,18 +1,118 @@
+class ResourceRef(object):
+    """A resource ID or ARN split into its parts once, when it is read, and handed along from there. For a
+    bare ID such as i-0123 or a bucket name only resource_id and id are set."""
+    __slots__ = ('resource_id', 'partition', 'service', 'region', 'account', 'resource_type', 'id')
 
-def parse_arn(arn):
-    # http://docs.aws.amazon.com/general/latest/gr/aws-arns-and-namespaces.html
-    elements = arn.split(':', 5)
-    result = {
-        'arn': elements[0],
-        'partition': elements[1],
-        'service': elements[2],
-        'region': elements[3],
-        'account': elements[4],
-        'resource': elements[5],
-        'resource_type': None
-    }
-    if '/' in result['resource']:
-        result['resource_type'], result['resource'] = result['resource'].split('/', 1)
-    elif ':' in result['resource']:
-        result['resource_type'], result['resource'] = result['resource'].split(':', 1)
-    return result
+    def __init__(self, resource_id, partition=None, service=None, region=None, account=None, resource_type=None,
+                 id=None):
+        self.resource_id = resource_id
+        self.partition = partition
+        self.service = service
+        self.region = region
+        self.account = account
+        self.resource_type = resource_type
+        self.id = resource_id if id is None else id
+
+    @classmethod
+    def parse(cls, resource_id):
+        # http://docs.aws.amazon.com/general/latest/gr/aws-arns-and-namespaces.html
+        if not resource_id.startswith('arn:'):
+            return cls(resource_id)
+
+        elements = resource_id.split(':', 5)
+        if len(elements) < 6:
+            return cls(resource_id)
+
+        resource_type = None
+        resource = elements[5]
+        # the type is separated from the ID by whichever of / or : comes first
+        slash = resource.find('/')
+        colon = resource.find(':')
+        separator = slash if colon < 0 or 0 <= slash < colon else colon
+        if separator >= 0:
+            resource_type, resource = resource[:separator], resource[separator + 1:]
+
+        return cls(resource_id, elements[1], elements[2], elements[3], elements[4], resource_type, resource)
+
+    @property
+    def is_arn(self):
+        return self.service is not None
+
+    def __repr__(self):
+        return 'ResourceRef(%r)' % self.resource_id
+
+
+def resource_ref(resource):
+    """Accepts either a ResourceRef or a resource ID string."""
+    if isinstance(resource, ResourceRef):
+        return resource
+    return ResourceRef.parse(resource)
+
+
+class TagSet(dict):
+    """An immutable set of tags, made with intern_tags() so that all the rows with the same tags share one
+    TagSet. It hashes and compares as a key for the groups that are batched together, and its AWS form and
+    its split into values and removals are worked out once, the first time they are needed."""
+    __slots__ = ('_hash', '_aws_tags', '_split')
+
+    def __hash__(self):
+        return self._hash
+
+    def _immutable(self, *args, **kwargs):
+        raise TypeError("TagSet is immutable")
+
+    __setitem__ = __delitem__ = __ior__ = clear = pop = popitem = setdefault = update = _immutable
+
+    @property
+    def aws_tags(self):
+        # callers hand this list straight to boto3 and must not change it
+        if self._aws_tags is None:
+            self._aws_tags = [{'Key': key, 'Value': value} for (key, value) in self.items()
+                              if not key.startswith('aws:')]
+        return self._aws_tags
+
+    def split(self):
+        """Returns the tags with a value as a TagSet and the sorted keys whose value is None, for removal."""
+        if self._split is None:
+            self._split = (intern_tags((key, value) for (key, value) in self.items() if value is not None),
+                           sorted(key for (key, value) in self.items() if value is None))
+        return self._split
+
+    def __repr__(self):
+        return 'TagSet(%s)' % dict.__repr__(self)
+
+
+# distinct tag sets remembered before the table starts over; rows already holding a TagSet keep it
+MAX_TAG_SETS = 16384
+
+# each TagSet maps to itself so that an equal one can be looked up. Lookups and inserts are single dict
+# operations, so no lock is needed; two threads interning the same new tags at once still get the same TagSet
+# from setdefault
+_tag_sets = {}
+
+
+def intern_tags(tags):
+    """Returns the TagSet holding tags, a dict or (key, value) pairs, creating it the first time those tags
+    are seen."""
+    if isinstance(tags, TagSet):
+        return tags
+    return intern_sorted_tags(tuple(sorted(tags.items() if isinstance(tags, dict) else tags)))
+
+
+def intern_sorted_tags(items):
+    """intern_tags() for a tuple of (key, value) pairs already sorted by key."""
+    tag_set = TagSet(items)
+    tag_set._hash = hash(items)
+    tag_set._aws_tags = None
+    tag_set._split = None
+    interned = _tag_sets.get(tag_set)
+    if interned is not None:
+        return interned
+    if len(_tag_sets) >= MAX_TAG_SETS:
+        _tag_sets.clear()
+    return _tag_sets.setdefault(tag_set, tag_set)
+
+
+def chunks(items, size):
+    for index in range(0, len(items), size):
+        yield items[index:index + size]
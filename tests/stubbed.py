@@ -0,0 +1,54 @@
+import os
+import threading
+
+from benchmarks.stub import StubBackend
+from tagger import base_tagger, s3_tagger
+
+_backend = None
+_lock = threading.Lock()
+
+
+def _attach(aws_client):
+    if _backend is not None:
+        _backend.attach(aws_client)
+
+
+base_tagger.add_client_hook(_attach)
+
+
+def _reset():
+    base_tagger._clients.clear()
+    base_tagger._sessions.clear()
+    s3_tagger._bucket_regions.clear()
+
+
+class StubbedAWS(object):
+    """Answers every client created inside the block with a benchmarks.stub.StubBackend, so nothing is sent
+    to AWS. Clients, and the bucket regions they found, are dropped on the way in and out so that every
+    block starts from nothing."""
+
+    def __init__(self, **kwargs):
+        self.backend = StubBackend(**kwargs)
+        self.environ = {}
+
+    def __enter__(self):
+        global _backend
+        for (name, value) in (('AWS_ACCESS_KEY_ID', 'test'), ('AWS_SECRET_ACCESS_KEY', 'test'),
+                              ('AWS_REGION', 'us-east-1')):
+            self.environ[name] = os.environ.get(name)
+            os.environ[name] = value
+        with _lock:
+            _backend = self.backend
+        _reset()
+        return self.backend
+
+    def __exit__(self, *exc_info):
+        global _backend
+        with _lock:
+            _backend = None
+        _reset()
+        for (name, value) in self.environ.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
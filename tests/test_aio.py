@@ -0,0 +1,64 @@
+import contextlib
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+from tagger.aio import AsyncCSVResourceTagger
+from tests.stubbed import StubbedAWS
+
+ROWS = [
+    ('i-00000000000000001', 'web'),
+    ('arn:aws:rds:us-east-1:123456789012:db:orders', 'web'),
+    ('i-00000000000000002', 'batch'),
+    ('my-bucket', 'web'),
+    ('arn:aws:rds:us-east-1:123456789012:db:users', 'batch'),
+    ('i-00000000000000003', 'web'),
+]
+
+
+class AsyncCSVResourceTaggerTest(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.filename = os.path.join(directory, 'resources.csv')
+        with open(self.filename, 'w') as output:
+            output.write('Id,Region,App\n')
+            for (resource_id, app) in ROWS:
+                output.write('%s,us-east-1,%s\n' % (resource_id, app))
+
+    def tag(self, concurrency):
+        output = io.StringIO()
+        # each request takes long enough that, with concurrency, later rows can finish before earlier ones
+        with StubbedAWS(latency=0.01) as backend, contextlib.redirect_stdout(output):
+            AsyncCSVResourceTagger(False, False, region='us-east-1', concurrency=concurrency).tag(self.filename)
+        return output.getvalue().splitlines(), backend.calls
+
+    def test_output_is_in_file_order(self):
+        lines, _ = self.tag(concurrency=4)
+        applying = [line.split(' ', 3)[-1] for line in lines if line.startswith('Applying tags to ')]
+        self.assertEqual(applying, [resource_id for (resource_id, _) in ROWS])
+        # batched resources are reported once their batch is sent, after every row has been applied
+        tagged = [line.split(' ', 4)[-1] for line in lines if line.startswith('Successfully applied tags to ')]
+        self.assertEqual(sorted(tagged), sorted(resource_id for (resource_id, _) in ROWS))
+
+    def test_rows_share_batched_calls(self):
+        _, calls = self.tag(concurrency=4)
+        self.assertEqual(calls, {
+            # one call for each tag set
+            ('ec2', 'CreateTags'): 2,
+            ('resourcegroupstaggingapi', 'TagResources'): 2,
+            ('s3', 'GetBucketLocation'): 1,
+            ('s3', 'GetBucketTagging'): 1,
+            ('s3', 'PutBucketTagging'): 1,
+        })
+
+    def test_same_calls_at_any_concurrency(self):
+        _, sequential = self.tag(concurrency=1)
+        _, concurrent = self.tag(concurrency=8)
+        self.assertEqual(sequential, concurrent)
+
+
+if __name__ == '__main__':
+    unittest.main()
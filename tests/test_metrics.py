@@ -0,0 +1,49 @@
+import io
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from tagger import metrics
+from tagger.tagger import MultipleResourceTagger
+from tests.stubbed import StubbedAWS
+
+
+class MetricsTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.addCleanup(metrics.close)
+
+    def test_batch_size_is_the_number_of_resources_in_the_call(self):
+        path = os.path.join(self.directory, 'calls.jsonl')
+        summary = metrics.SummarySink(io.StringIO())
+        metrics.configure([metrics.JSONLinesSink(path), summary])
+
+        with StubbedAWS():
+            MultipleResourceTagger(False, False, region='us-east-1').tag(['i-1', 'i-2', 'i-3'], {'App': 'web'})
+        metrics.close()
+
+        with open(path) as calls:
+            calls = [json.loads(line) for line in calls]
+        self.assertEqual([(call['operation'], call['batch_size']) for call in calls], [('CreateTags', 3)])
+        self.assertEqual([(key, totals['resources']) for (key, totals) in summary.items()],
+                         [(('ec2', 'CreateTags', 'us-east-1'), 3)])
+
+    def test_calls_without_a_resource_list_have_no_batch_size(self):
+        path = os.path.join(self.directory, 'calls.jsonl')
+        metrics.configure([metrics.JSONLinesSink(path)])
+
+        with StubbedAWS():
+            MultipleResourceTagger(False, False, region='us-east-1').tag(['my-bucket'], {'App': 'web'})
+        metrics.close()
+
+        with open(path) as calls:
+            calls = [json.loads(line) for line in calls]
+        self.assertTrue(calls)
+        self.assertEqual({call['batch_size'] for call in calls}, {None})
+
+
+if __name__ == '__main__':
+    unittest.main()